@@ -0,0 +1,62 @@
+# — coding: utf-8 –
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'easytool'))
+from retriever import *
+
+
+def perturbed_queries(retriever, n_queries, noise, seed):
+    """Tool embeddings plus Gaussian noise stand in for subtask embeddings, so no API call is needed."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(retriever.matrix), size=n_queries, replace=False)
+    queries = np.asarray(retriever.matrix[np.sort(rows)], dtype=np.float32)
+    return queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+
+
+def timed_search(index, queries, k):
+    start = time.perf_counter()
+    results = [index.search(query, k) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recall@k and latency of the IVF index against exact search")
+    parser.add_argument('--store', type=str, default='data_toolbench/tool_instruction/API_description_embeddings')
+    parser.add_argument('--synthetic', type=int, default=0, help='benchmark N random vectors instead of a store')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.02)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--n_lists', type=int, default=0)
+    parser.add_argument('--nprobe', type=str, default='1,2,4,8,16,32')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        # Clustered vectors, closer to real tool descriptions than uniform noise.
+        centers = rng.normal(size=(max(args.synthetic // 500, 1), args.dim))
+        vectors = centers[rng.integers(len(centers), size=args.synthetic)] + rng.normal(size=(args.synthetic, args.dim))
+        retriever = EmbeddingRetriever(vectors, list(range(args.synthetic)))
+    else:
+        retriever = load_embedding_store(args.store)
+    queries = perturbed_queries(retriever, args.queries, args.noise, seed=1)
+
+    exact, exact_ms = timed_search(retriever, queries, args.k)
+    start = time.perf_counter()
+    index = IVFIndex.build(retriever, n_lists=args.n_lists or None)
+    build_s = time.perf_counter() - start
+    print(f"tools: {len(retriever.matrix)}  lists: {len(index.centroids)}  build: {build_s:.1f}s")
+    print(f"exact      recall@{args.k}: 1.000  latency: {exact_ms:.2f} ms/query")
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        index.nprobe = nprobe
+        approx, approx_ms = timed_search(index, queries, args.k)
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+        print(f"nprobe={nprobe:<4} recall@{args.k}: {recall:.3f}  latency: {approx_ms:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# — coding: utf-8 –
+import argparse
+import contextlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_TOOLS = os.path.join(BENCH_DIR, 'stub_tools')
+TASKS = ['funcqa_mh', 'funcqa_oh', 'toolbench', 'toolbench_retrieve', 'restbench']
+
+
+def start_stub(args):
+    """Run stub_server.py in its own process, so that it does not compete with the pipeline for the GIL."""
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'stub_server.py'), '--port', '0',
+                                '--llm_latency_ms', str(args.llm_latency_ms),
+                                '--llm_latency_sigma', str(args.llm_latency_sigma),
+                                '--tool_latency_ms', str(args.tool_latency_ms),
+                                '--tool_latency_sigma', str(args.tool_latency_sigma),
+                                '--subtasks', str(args.subtasks),
+                                '--check_fail_rate', str(args.check_fail_rate)],
+                               stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline())
+    return process, f"http://127.0.0.1:{port}"
+
+
+def stub_tool_dataset():
+    """toolbench_tool_instruction.json entries describing the stub tools."""
+    dataset = {}
+    category = os.path.join(STUB_TOOLS, 'bench')
+    for n, tool in enumerate(sorted(os.listdir(category))):
+        spec = importlib.util.spec_from_file_location('api', os.path.join(category, tool, 'api.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        apis = {}
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            if func.__module__ == module.__name__:
+                apis[name] = {"description": func.__doc__, "required_parameters": [],
+                              "optional_parameters": [{"name": "query", "type": "STRING", "default": "benchmark"}]}
+        dataset[str(n)] = {"ID": n, "tool_name": tool, "standardized_name": tool,
+                           "tool_description": module.TOOL_DESCRIPTION, "tool_guidelines": apis}
+    return dataset
+
+
+def run_task(task, queries, workers, model_name, planning='staged', speculate=1):
+    """Run one task end to end in the current directory."""
+    sys.path.insert(0, os.path.join(REPO_DIR, 'easytool'))
+    from util import read_json, read_jsonline
+    if task.startswith('funcqa'):
+        import funcQA
+        dataset = read_json('data_funcqa/tool_instruction/functions_data.json')
+        Tool_dic = read_jsonline('data_funcqa/tool_instruction/tool_dic.jsonl')
+        test_data = [{"question": f"What is {i} plus 2?"} for i in range(queries)]
+        run = funcQA.task_execution_mh if task == 'funcqa_mh' else funcQA.task_execution_oh
+        run(task, 5, model_name, dataset, Tool_dic, test_data, f"{task}_progress.txt", workers)
+    elif task.startswith('toolbench'):
+        import toolbench
+        import toolbench_retrieve
+        dataset = stub_tool_dataset()
+        index = toolbench.load_tool_index(STUB_TOOLS, 'tool_index.json')
+        tool_dic = [{key: tool["tool_description"]} for key, tool in dataset.items()]
+        test_data = [{"query": f"Benchmark question {i}", "Tool_dic": tool_dic} for i in range(queries)]
+        if task == 'toolbench':
+            toolbench.task_execution('G3', STUB_TOOLS, index, dataset, test_data, f"{task}_progress.txt",
+                                     5, model_name, workers, planning=planning, speculate=speculate)
+        else:
+            os.makedirs('data_toolbench/tool_instruction', exist_ok=True)
+            filenames = list(dataset.keys())
+            embeddings = toolbench_retrieve.get_embeddings([dataset[key]["tool_description"] for key in filenames])
+            with open('data_toolbench/tool_instruction/API_description_embeddings.pkl', 'wb') as f:
+                pickle.dump((filenames, embeddings), f)
+            toolbench_retrieve.task_execution('G3', STUB_TOOLS, index, dataset, test_data, f"{task}_progress.txt",
+                                              5, model_name, workers, planning=planning, speculate=speculate)
+    elif task == 'restbench':
+        import restbench
+        Tool_dic = read_json('data_restbench/tool_instruction/tmdb_tool.json')
+        dic_tool = {data['ID']: data for data in Tool_dic}
+        test_data = [{"query": f"Benchmark question {i}"} for i in range(queries)]
+        restbench.task_execution(Tool_dic, dic_tool, test_data, f"{task}_progress.txt", 5, model_name, workers)
+    else:
+        raise ValueError(f"Unknown task {task}")
+
+
+def bench_task(args):
+    """Benchmark one task in a scratch directory and return its metrics."""
+    archive = args.record or args.replay
+    if archive:
+        # Each task gets its own archive next to the given path.
+        root, ext = os.path.splitext(os.path.abspath(archive))
+        archive = f"{root}.{args.task}{ext}"
+    workdir = tempfile.mkdtemp(prefix=f"easytool_bench_{args.task}_")
+    for data_dir in ('data_funcqa', 'data_restbench'):
+        os.symlink(os.path.join(REPO_DIR, data_dir), os.path.join(workdir, data_dir))
+    os.chdir(workdir)
+    os.environ.update({"OPENAI_API_KEY": "stub", "OPENAI_API_BASE": args.api_base + "/v1", "RAPIDAPI_KEY": "stub",
+                       "EASYTOOL_STUB_TOOL_URL": args.api_base, "EASYTOOL_TRACE_FILE": "trace.json",
+                       "EASYTOOL_MAX_INFLIGHT": str(args.max_inflight)})
+    if archive:
+        os.environ["EASYTOOL_ARCHIVE"] = archive
+        os.environ["EASYTOOL_ARCHIVE_MODE"] = 'record' if args.record else 'replay'
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull), \
+                contextlib.redirect_stderr(sys.stderr if args.verbose else devnull):
+            run_task(args.task, args.queries, args.workers, 'stub-model', args.planning, args.speculate)
+    with open('trace.json', 'r', encoding='utf-8') as f:
+        events = json.load(f)["traceEvents"]
+    queries = [event for event in events if event["name"] == "query"]
+    latencies = np.array([event["dur"] / 1000 for event in queries])
+    # Measured from the first query start to the last query end, so imports and set-up do not count.
+    wall = (max(event["ts"] + event["dur"] for event in queries) - min(event["ts"] for event in queries)) / 1e6
+    return {"task": args.task, "queries": len(latencies), "workers": args.workers,
+            "qps": len(latencies) / wall, "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            # ru_maxrss is in kilobytes on Linux.
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "workdir": workdir}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against a stub LLM and stub tools")
+    parser.add_argument('--task', type=str, default='all', help=f"one of {', '.join(TASKS)} or all")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--max_inflight', type=int, default=64)
+    parser.add_argument('--llm_latency_ms', type=float, default=300, help='median chat completion latency')
+    parser.add_argument('--llm_latency_sigma', type=float, default=0.5, help='log-normal shape, 0 for constant')
+    parser.add_argument('--tool_latency_ms', type=float, default=100, help='median tool call latency')
+    parser.add_argument('--tool_latency_sigma', type=float, default=0.5)
+    parser.add_argument('--subtasks', type=int, default=3, help='subtasks returned by task decomposition')
+    parser.add_argument('--planning', type=str, default='staged', help='toolbench planning, staged or fused')
+    parser.add_argument('--speculate', type=int, default=1, help='toolbench candidate tools tried concurrently')
+    parser.add_argument('--check_fail_rate', type=float, default=0, help='share of answer checks the stub rejects')
+    parser.add_argument('--api_base', type=str, default='', help='use a running stub_server.py instead of starting one')
+    parser.add_argument('--record', type=str, default='', help='record every task into an archive per task')
+    parser.add_argument('--replay', type=str, default='', help='replay --record archives with no stub server')
+    parser.add_argument('--json', action='store_true', help='print the metrics as one JSON line per task')
+    parser.add_argument('--verbose', action='store_true', help='keep the pipeline output')
+    args = parser.parse_args()
+
+    stub = None
+    if args.replay:
+        # Nothing listens here, so any request that was not recorded fails instead of reaching a server.
+        args.api_base = args.api_base or 'http://127.0.0.1:9'
+    if not args.api_base:
+        stub, args.api_base = start_stub(args)
+    try:
+        if args.task != 'all':
+            results = [bench_task(args)]
+        else:
+            # One process per task, so that peak RSS is measured per task.
+            results = []
+            for task in TASKS:
+                command = [sys.executable, os.path.abspath(__file__), '--json'] + \
+                          [arg for arg in sys.argv[1:] if arg != '--json'] + \
+                          ['--task', task, '--api_base', args.api_base]
+                output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['task']:<20} {result['queries']:>4} queries  {result['qps']:7.2f} q/s  "
+                  f"p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                  f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
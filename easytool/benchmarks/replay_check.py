@@ -0,0 +1,36 @@
+# — coding: utf-8 –
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline_bench.py')
+
+
+def bench(*args):
+    return subprocess.run([sys.executable, BENCH, '--llm_latency_ms', '1', '--tool_latency_ms', '1'] + list(args),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a replay passes on its own recording and fails on a missing entry")
+    parser.add_argument('--task', type=str, default='all')
+    parser.add_argument('--queries', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    archive = os.path.join(tempfile.mkdtemp(prefix="easytool_replay_check_"), 'run.sqlite')
+    common = ['--task', args.task, '--workers', str(args.workers)]
+    if bench(*common, '--queries', str(args.queries), '--record', archive) != 0:
+        sys.exit("recording failed")
+    if bench(*common, '--queries', str(args.queries), '--replay', archive) != 0:
+        sys.exit("replaying the recorded queries failed")
+    # The extra query was never recorded, so the replay has to stop instead of falling back.
+    if bench(*common, '--queries', str(args.queries + 1), '--replay', archive) == 0:
+        sys.exit("a replay with a missing entry exited with status 0")
+    print("replay check passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# — coding: utf-8 –
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EMBEDDING_DIM = 64
+
+
+def sample_latency(median_ms, sigma):
+    """Log-normal latency in seconds with the given median; sigma 0 gives a constant."""
+    if median_ms <= 0:
+        return 0
+    if sigma <= 0:
+        return median_ms / 1000
+    return random.lognormvariate(math.log(median_ms), sigma) / 1000
+
+
+def stub_embedding(text):
+    # Seeded by the text, so the same text always gets the same vector.
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    return [rng.gauss(0, 1) for _ in range(EMBEDDING_DIM)]
+
+
+def choose_tool(prompt):
+    ids = re.findall(r"ID'?\"?:\s*(\d+)", prompt.split("Tool List:")[-1])
+    return json.dumps({"ID": int(ids[0]) if ids else -1})
+
+
+def rank_tools(prompt):
+    ids = re.findall(r"ID: (\d+)", prompt.split("Tool List:")[-1])
+    return json.dumps({"IDs": [int(i) for i in ids]})
+
+
+def choose_api(prompt):
+    match = re.search(r"This is the API list: (\[.*?\])", prompt)
+    apis = re.findall(r"'([^']+)'", match.group(1)) if match else []
+    return json.dumps(apis[:1])
+
+
+def choose_parameter(prompt):
+    # FuncQA functions take a single list named input; the stub tools take a query string.
+    if "'name': 'input'" in prompt:
+        return json.dumps({"Parameters": {"input": [2, 1]}})
+    return json.dumps({"Parameters": {"query": "benchmark"}})
+
+
+def choose_plan(prompt):
+    match = re.search(r"ID: (\d+)\n[\s\S]*?\nAPIs: (.*)", prompt)
+    if not match:
+        return json.dumps({"ID": -1, "apis": []})
+    api = next(iter(json.loads(match.group(2))), "")
+    return json.dumps({"ID": int(match.group(1)), "apis": [{"api_name": api, "Parameters": {"query": "benchmark"}}]})
+
+
+def task_topology(prompt):
+    ids = [int(i) for i in re.findall(r"'id': (\d+)", prompt.split("These are subtasks of this question:")[-1])]
+    return json.dumps([{"task": f"subtask {i}", "id": i, "dep": -1 if i == ids[0] else [ids[0]]} for i in ids])
+
+
+def restbench_path(prompt):
+    ids = re.findall(r"'ID': (\d+)", prompt)
+    return json.dumps([{"Task": f"step {n + 1}", "ID": int(i)} for n, i in enumerate(ids[:2])])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat and embedding endpoints plus RapidAPI-style tool endpoints.
+
+    Chat prompts are matched to the EasyTool stage that produced them and answered with a
+    well-formed output for that stage.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY a kept-alive connection
+    # waits for the client's delayed ACK on every response.
+    disable_nagle_algorithm = True
+    llm_latency = (0, 0)
+    tool_latency = (0, 0)
+    subtasks = 3
+    check_fail_rate = 0
+
+    def stage_output(self, prompt):
+        if "Please check whether the response can reasonably" in prompt or "As a powerful language model" in prompt:
+            if random.random() < self.check_fail_rate:
+                return json.dumps({"Reason": "The response does not answer the question.", "Choice": "No"})
+            return json.dumps({"Reason": "The response answers the question.", "Choice": "Yes"})
+        if "I have decompose this question into some simple subtasks" in prompt:
+            return task_topology(prompt)
+        if "We have spotify database" in prompt:
+            return restbench_path(prompt)
+        if "decompose a complex user's question into some simple subtasks" in prompt:
+            return json.dumps({"Tasks": [f"subtask {i + 1}" for i in range(self.subtasks)]})
+        if "You need to choose the tool, the APIs and their parameters" in prompt:
+            return choose_plan(prompt)
+        if "You should rank the tools in the Tool List" in prompt:
+            return rank_tools(prompt)
+        if "These are the tools you can select" in prompt:
+            return choose_tool(prompt)
+        if "you should choose APIs from the API list" in prompt:
+            return choose_api(prompt)
+        if "you need to output parameters according to the API tool documentation" in prompt:
+            return choose_parameter(prompt)
+        return "The answer is 42."
+
+    def send_json(self, payload):
+        out = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path.endswith('/embeddings'):
+            inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+            self.send_json({"object": "list", "model": body.get("model"),
+                            "data": [{"object": "embedding", "index": i, "embedding": stub_embedding(text)}
+                                     for i, text in enumerate(inputs)]})
+            return
+        time.sleep(sample_latency(*self.llm_latency))
+        prompt = body['messages'][-1]['content']
+        content = self.stage_output(prompt)
+        prompt_tokens = sum(len(message['content']) for message in body['messages']) // 4
+        self.send_json({"id": "chatcmpl-stub", "object": "chat.completion", "model": body.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                     "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                                  "total_tokens": prompt_tokens + len(content) // 4}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        time.sleep(sample_latency(*self.tool_latency))
+        self.send_json({"path": url.path, "params": parse_qs(url.query), "result": "stub result"})
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, llm_latency=(0, 0), tool_latency=(0, 0), subtasks=3, check_fail_rate=0):
+    StubHandler.llm_latency = llm_latency
+    StubHandler.tool_latency = tool_latency
+    StubHandler.subtasks = subtasks
+    StubHandler.check_fail_rate = check_fail_rate
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub OpenAI and tool server for offline benchmarks")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--llm_latency_ms', type=float, default=300, help='median chat completion latency')
+    parser.add_argument('--llm_latency_sigma', type=float, default=0.5, help='log-normal shape, 0 for constant')
+    parser.add_argument('--tool_latency_ms', type=float, default=100, help='median tool call latency')
+    parser.add_argument('--tool_latency_sigma', type=float, default=0.5)
+    parser.add_argument('--subtasks', type=int, default=3, help='subtasks returned by task decomposition')
+    parser.add_argument('--check_fail_rate', type=float, default=0, help='share of answer checks that reject the answer')
+    args = parser.parse_args()
+    server = serve(args.port, (args.llm_latency_ms, args.llm_latency_sigma),
+                   (args.tool_latency_ms, args.tool_latency_sigma), args.subtasks, args.check_fail_rate)
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,31 @@
+import os
+import requests
+
+TOOL_URL = os.environ.get("EASYTOOL_STUB_TOOL_URL", "http://127.0.0.1:8765")
+TOOL_DESCRIPTION = "Currency exchange rates and conversion."
+
+
+def exchange_rate(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Get the exchange rate between two currencies."""
+    url = f"{TOOL_URL}/tools/currency_stub/exchange_rate"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "currency_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
+
+
+def convert(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Convert an amount from one currency to another."""
+    url = f"{TOOL_URL}/tools/currency_stub/convert"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "currency_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
@@ -0,0 +1,31 @@
+import os
+import requests
+
+TOOL_URL = os.environ.get("EASYTOOL_STUB_TOOL_URL", "http://127.0.0.1:8765")
+TOOL_DESCRIPTION = "Search movies, actors and reviews."
+
+
+def search_movie(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Search movies by title or keyword."""
+    url = f"{TOOL_URL}/tools/movie_stub/search_movie"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "movie_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
+
+
+def movie_reviews(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Get the reviews of a movie."""
+    url = f"{TOOL_URL}/tools/movie_stub/movie_reviews"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "movie_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
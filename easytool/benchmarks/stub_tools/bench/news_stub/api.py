@@ -0,0 +1,31 @@
+import os
+import requests
+
+TOOL_URL = os.environ.get("EASYTOOL_STUB_TOOL_URL", "http://127.0.0.1:8765")
+TOOL_DESCRIPTION = "Latest news headlines by topic."
+
+
+def headlines(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Get the latest headlines."""
+    url = f"{TOOL_URL}/tools/news_stub/headlines"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "news_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
+
+
+def search_news(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Search news articles by keyword."""
+    url = f"{TOOL_URL}/tools/news_stub/search_news"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "news_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
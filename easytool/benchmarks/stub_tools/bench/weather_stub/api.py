@@ -0,0 +1,31 @@
+import os
+import requests
+
+TOOL_URL = os.environ.get("EASYTOOL_STUB_TOOL_URL", "http://127.0.0.1:8765")
+TOOL_DESCRIPTION = "Current weather and forecasts for any city."
+
+
+def current_weather(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Get the current weather of a city."""
+    url = f"{TOOL_URL}/tools/weather_stub/current_weather"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "weather_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
+
+
+def forecast(query: str = 'benchmark', toolbench_rapidapi_key: str = ''):
+    """Get the weather forecast of a city for the next days."""
+    url = f"{TOOL_URL}/tools/weather_stub/forecast"
+    querystring = {'query': query}
+    headers = {"X-RapidAPI-Key": toolbench_rapidapi_key, "X-RapidAPI-Host": "weather_stub.stub"}
+    response = requests.get(url, headers=headers, params=querystring)
+    try:
+        observation = response.json()
+    except:
+        observation = response.text
+    return observation
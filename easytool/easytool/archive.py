@@ -0,0 +1,61 @@
+# — coding: utf-8 –
+import functools
+import json
+import os
+import threading
+from cache import *
+
+_archive = None
+_archive_lock = threading.Lock()
+_MISSING = object()
+
+
+class ReplayMiss(Exception):
+    """Raised in replay mode when a call was not recorded in the archive."""
+
+
+def get_archive():
+    """The record/replay archive named by EASYTOOL_ARCHIVE, or None when neither mode is on.
+
+    One SQLite file holds the LLM responses, embeddings and tool call results of a run; it is
+    opened read-only when EASYTOOL_ARCHIVE_MODE is replay.
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is None and os.environ.get("EASYTOOL_ARCHIVE"):
+            _archive = SQLiteCache(os.environ["EASYTOOL_ARCHIVE"], readonly=replaying())
+    return _archive
+
+
+def replaying():
+    return bool(os.environ.get("EASYTOOL_ARCHIVE")) and os.environ.get("EASYTOOL_ARCHIVE_MODE") == "replay"
+
+
+def _jsonable(value):
+    # Results that JSON cannot hold, such as objects returned by a tool, are recorded as their str.
+    try:
+        json.dumps(value, ensure_ascii=False)
+        return value
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def recorded(namespace, key):
+    """Record the results of the decorated function, keyed by key(*args, **kwargs), or replay them."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            archive = get_archive()
+            if archive is None:
+                return func(*args, **kwargs)
+            entry = cache_key(namespace, key(*args, **kwargs))
+            if replaying():
+                value = archive.get(entry, _MISSING)
+                if value is _MISSING:
+                    raise ReplayMiss(f"{namespace} call {key(*args, **kwargs)} was not recorded")
+                return value
+            value = _jsonable(func(*args, **kwargs))
+            archive.set(entry, value)
+            return value
+        return wrapper
+    return decorate
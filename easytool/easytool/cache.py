@@ -0,0 +1,82 @@
+# — coding: utf-8 –
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_key(*parts):
+    """Hash JSON-serializable parts into a stable content address."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SQLiteCache:
+    """Persistent key/value store for JSON values with least-recently-used eviction.
+
+    When max_bytes is set, the oldest accessed entries are dropped once the stored values
+    grow past it. A readonly cache never writes to the file, not even access times.
+    """
+
+    def __init__(self, path, max_bytes=None, readonly=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache "
+                               "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if not self.readonly:
+                self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if self.readonly:
+            return
+        value = json.dumps(value, ensure_ascii=False)
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                               (key, value, size, time.time()))
+            self._total += size - (old[0] if old else 0)
+            if self.max_bytes is not None and self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop about a tenth more than needed so that eviction does not run on every insert.
+        target = self._total - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY accessed"):
+            if freed >= target:
+                break
+            keys.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+        self._total -= freed
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._total}
@@ -0,0 +1,62 @@
+# — coding: utf-8 –
+import os
+import threading
+import openai
+from cache import *
+from archive import *
+from llm import *
+
+openai.api_key = os.environ["OPENAI_API_KEY"]
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Inputs sent per embedding request; the API accepts up to 2048.
+EMBEDDING_BATCH = 512
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """The on-disk embedding cache named by EASYTOOL_EMBEDDING_CACHE, or None when unset.
+
+    While a run is recorded or replayed, embeddings are kept in the archive instead.
+    """
+    global _cache
+    if get_archive() is not None:
+        return get_archive()
+    with _cache_lock:
+        if _cache is None and os.environ.get("EASYTOOL_EMBEDDING_CACHE"):
+            _cache = SQLiteCache(os.environ["EASYTOOL_EMBEDDING_CACHE"])
+    return _cache
+
+
+def get_embeddings(texts, model=EMBEDDING_MODEL):
+    """Embed texts, sending every text that is not cached yet in as few requests as possible."""
+    cache = get_embedding_cache()
+    embeddings = {}
+    unique_texts = list(dict.fromkeys(texts))
+    if cache is not None:
+        for text in unique_texts:
+            embedding = cache.get(cache_key(model, text))
+            if embedding is not None:
+                embeddings[text] = embedding
+    missing = [text for text in unique_texts if text not in embeddings]
+    if missing and replaying():
+        raise ReplayMiss(f"{len(missing)} embeddings were not recorded, e.g. {missing[0][:80]!r}")
+    for start in range(0, len(missing), EMBEDDING_BATCH):
+        batch = missing[start:start + EMBEDDING_BATCH]
+        def attempt(ind):
+            return get_llm_client().embed(batch, model)
+        response = retry_call("embedding", attempt, default=None)
+        if response is None:
+            raise RuntimeError(f"Embedding {len(batch)} texts failed")
+        for item in response['data']:
+            text = batch[item['index']]
+            embeddings[text] = item['embedding']
+            if cache is not None:
+                cache.set(cache_key(model, text), item['embedding'])
+    return [embeddings[text] for text in texts]
+
+
+def get_embedding(text, model=EMBEDDING_MODEL):
+    return get_embeddings([text], model)[0]
@@ -4,46 +4,35 @@ import json
 import logging
 import sys
 import argparse
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate
 )
-from langchain import LLMChain
 import numpy as np
 import requests
 import os
 import subprocess
 import re
 import importlib.util
+import inspect
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 from util import *
+from llm import *
+from parsing import *
+from retry import *
+from tracing import *
+from archive import *
+from scheduler import *
 from tqdm import tqdm
 
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
 
-def get_last_processed_index(progress_file):
-    """Retrieve the last processed index from the progress file."""
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            last_index = f.read().strip()
-            return int(last_index) if last_index else 0
-    else:
-        return 0
-
-
-def update_progress(progress_file, index):
-    """Update the last processed index in the progress file."""
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        f.write(str(index))
-
-
+@traced
 def choose_tool(question, Tool_dic, tool_used, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -61,33 +50,24 @@ def choose_tool(question, Tool_dic, tool_used, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
     Tool_list = []
     for ele in Tool_dic:
         for key in ele.keys():
             if str(key) not in tool_used:
                 Tool_list.append(f'''ID: {key}\n{ele[key]}''')
-    while True:
-        try:
-            result = chain.run(question=question,
-                               Too_list=Tool_dic)
-            clean_answer = eval(result.split("(")[0].strip())
-            # clean_answer = lowercase_parameter_keys(clean_answer)
-            # print(clean_answer)
-            break
-        except Exception as e:
-            print(f"choose tool fails: {e}")
-            print(result)
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return clean_answer
-
-
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  Too_list=Tool_dic,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_tool', expect=dict)
+        # clean_answer = lowercase_parameter_keys(clean_answer)
+        # print(clean_answer)
+        return clean_answer
+    return retry_call("choose tool", attempt)
+
+
+@traced
 def task_decompose(question, Tool_dic, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -106,28 +86,19 @@ def task_decompose(question, Tool_dic, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
     Tool_list = []
     for ele in Tool_dic:
         Tool_list.append(str(ele))
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question, Tool_list=Tool_list)
-            result = eval(result.split('\n\n')[0])
-            a = result["Tasks"]
-            break
-        except Exception as e:
-            print(f"task decompose fails: {e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question, Tool_list=Tool_list, attempt=ind)
+        result = parse_structured(result, 'task_decompose', expect=dict)
+        a = result["Tasks"]
+        return result
+    return retry_call("task decompose", attempt)
 
 
+@traced
 def task_topology(question, task_ls, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -145,40 +116,31 @@ def task_topology(question, task_ls, model_name):
         "Output: "
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question, task_ls=task_ls)
-            result = eval(result)
-            for i in range(len(result)):
-                if isinstance(result[i]['dep'], str):
-                    temp = []
-                    for ele in result[i]['dep'].split(','):
-                        temp.append(int(ele))
-                    result[i]['dep'] = temp
-                elif isinstance(result[i]['dep'], int):
-                    result[i]['dep'] = [result[i]['dep']]
-                elif isinstance(result[i]['dep'], list):
-                    temp = []
-                    for ele in result[i]['dep']:
-                        temp.append(int(ele))
-                    result[i]['dep'] = temp
-                elif result[i]['dep'] == -1:
-                    result[i]['dep'] = [-1]
-            a = result[i]['dep'][0]
-            return result
-        except Exception as e:
-            print(f"task topology fails: {e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return result
-
-
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question, task_ls=task_ls, attempt=ind)
+        result = parse_structured(result, 'task_topology', expect=list)
+        for i in range(len(result)):
+            if isinstance(result[i]['dep'], str):
+                temp = []
+                for ele in result[i]['dep'].split(','):
+                    temp.append(int(ele))
+                result[i]['dep'] = temp
+            elif isinstance(result[i]['dep'], int):
+                result[i]['dep'] = [result[i]['dep']]
+            elif isinstance(result[i]['dep'], list):
+                temp = []
+                for ele in result[i]['dep']:
+                    temp.append(int(ele))
+                result[i]['dep'] = temp
+            elif result[i]['dep'] == -1:
+                result[i]['dep'] = [-1]
+        a = result[i]['dep'][0]
+        return result
+    return retry_call("task topology", attempt)
+
+
+@traced
 def answer_generation_direct(task, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -187,13 +149,12 @@ def answer_generation_direct(task, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(task=task)
+    result = llm_run(chat_prompt, model_name, task=task)
     return result
 
 
+@traced
 def choose_parameter(API_instruction, api, api_dic, question, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -213,29 +174,19 @@ def choose_parameter(API_instruction, api, api_dic, question, model_name):
         "Output:\n"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(api_dic=api_dic,
-                               question=question, )
-            clean_answer = eval(
-                result.replace(": true", ": True").replace(":true", ": True").replace(":false", ": False").replace(
-                    ": false", ": False").replace("```", "").strip())
-            a = clean_answer["Parameters"]
-
-            return a
-        except Exception as e:
-            print(f"Choose Parameter fails: {e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return a
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, api_dic=api_dic,
+                                                  question=question,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_parameter', expect=dict)
+        a = clean_answer["Parameters"]
 
+        return a
+    return retry_call("Choose Parameter", attempt)
 
+
+@traced
 def choose_parameter_depend(API_instruction, api, api_dic, question, model_name, previous_log):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -257,34 +208,55 @@ def choose_parameter_depend(API_instruction, api, api_dic, question, model_name,
         "Output:\n"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(api_dic=api_dic,
-                               question=question,
-                               previous_log=previous_log)
-            clean_answer = eval(
-                result.replace(": true", ": True").replace(": false", ": False").replace("```", "").strip())
-            a = clean_answer["Parameters"]
-
-            return a
-        except Exception as e:
-            print(f"choose parameter depend fails: {e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return a
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, api_dic=api_dic,
+                                                  question=question,
+                                                  previous_log=previous_log,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_parameter_depend', expect=dict)
+        a = clean_answer["Parameters"]
 
+        return a
+    return retry_call("choose parameter depend", attempt)
 
-def Call_function(B, arg, id):
-    app_path = 'data_funcqa/funchub/math.py'
+
+FUNCHUB_PATH = 'data_funcqa/funchub/math.py'
+funchub = {}
+
+
+def load_funchub(dataset=None, app_path=FUNCHUB_PATH):
+    """Load the funchub once into a name -> callable dispatch table.
+
+    Every standardized_name in dataset must be defined in the funchub and take exactly one
+    required argument, the list passed as "input"; otherwise a ValueError is raised.
+    """
+    global funchub
     spec = importlib.util.spec_from_file_location('math', app_path)
     app_module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(app_module)
-    if hasattr(app_module, B):
-        function_B = getattr(app_module, B)
+    table = {name: function for name, function in inspect.getmembers(app_module, inspect.isfunction)
+             if function.__module__ == app_module.__name__}
+    for tool in (dataset or {}).values():
+        name = tool["standardized_name"]
+        if name not in table:
+            raise ValueError(f"No function named {name} in {app_path}")
+        required = [p for p in inspect.signature(table[name]).parameters.values()
+                    if p.default is inspect.Parameter.empty]
+        if len(required) != 1:
+            raise ValueError(f"{name} in {app_path} must take exactly one required argument")
+    funchub = table
+    return table
+
+
+@traced
+@recorded("Call_function", lambda B, arg, id: (B, arg))
+def Call_function(B, arg, id):
+    annotate(api=B)
+    app_path = FUNCHUB_PATH
+    if not funchub:
+        load_funchub()
+    if B in funchub:
+        function_B = funchub[B]
         try:
             call_result = function_B(arg['input'])
             return call_result
@@ -308,6 +280,7 @@ def Call_function(B, arg, id):
                             "wrong": str(e)
                         }, ensure_ascii=False)
                         f.write(line + '\n')
+                    annotate(outcome="failed")
                     return -1
     else:
         with open('wrong_log.json', 'a+', encoding='utf-8') as f:
@@ -317,9 +290,25 @@ def Call_function(B, arg, id):
                 "wrong": f"No function named {B} in {app_path}"
             }, ensure_ascii=False)
             f.write(line + '\n')
+        annotate(outcome="failed")
         return (f"No function named {B} in {app_path}")
 
 
+@traced
+def call_functions_batch(calls, id):
+    """Evaluate many (function name, parameters) pairs through the funchub table in one call.
+
+    parameters may be the dict produced by choose_parameter or the bare "input" list.
+    """
+    results = []
+    for B, arg in calls:
+        if not isinstance(arg, dict):
+            arg = {'input': arg}
+        results.append(Call_function(B, arg, id))
+    return results
+
+
+@traced
 def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, previous_log=None):
     tool_id = choose_tool(question, Tool_dic, tool_used, model_name)
     if tool_id == -1:
@@ -358,13 +347,15 @@ def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, previous_
                     continue
                 call_results.append(str(call_result))
             elif isinstance(api["parameters"], list):
+                calls = []
                 for para_ls in api["parameters"]:
                     parameters = {}
                     for key in para_ls:
                         value = para_ls[key]
                         key = change_name(key)
                         parameters[key] = value
-                    call_result = Call_function(API_tool, parameters, ind)
+                    calls.append((API_tool, parameters))
+                for call_result in call_functions_batch(calls, ind):
                     if call_result == -1:
                         continue
                     call_results.append(str(call_result))
@@ -395,8 +386,8 @@ def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, previous_
     return tool_id, api_result, call_result, tool_instruction, API_instruction
 
 
+@traced
 def answer_generation(question, API_instruction, call_result, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -413,25 +404,17 @@ def answer_generation(question, API_instruction, call_result, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question,
-                               API_instruction=API_instruction,
-                               call_result=call_result, )
-            break
-        except Exception as e:
-            print(f"answer generation fails: {e}")
-            if ind > 2:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  API_instruction=API_instruction,
+                                                  call_result=call_result,
+                                                  attempt=ind)
+        return result
+    return retry_call("answer generation", attempt, max_attempts=4)
 
 
+@traced
 def answer_generation_depend(question, API_instruction, call_result, previous_log, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -453,26 +436,18 @@ def answer_generation_depend(question, API_instruction, call_result, previous_lo
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question,
-                               API_instruction=API_instruction,
-                               call_result=call_result,
-                               previous_log=previous_log)
-            break
-        except Exception as e:
-            print(f"answer generation depend fails: {e}")
-            if ind > 2:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  API_instruction=API_instruction,
+                                                  call_result=call_result,
+                                                  previous_log=previous_log,
+                                                  attempt=ind)
+        return result
+    return retry_call("answer generation depend", attempt, max_attempts=4)
 
 
+@traced
 def answer_summarize(question, answer_task, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -483,13 +458,12 @@ def answer_summarize(question, answer_task, model_name):
         "Final answer:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(question=question, answer_task=answer_task)
+    result = llm_run(chat_prompt, model_name, question=question, answer_task=answer_task)
     return result
 
 
+@traced
 def answer_check(question, answer, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -503,173 +477,200 @@ def answer_check(question, answer, model_name):
         "Output: "
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(question=question, answer=answer)
-    if 'yes'.lower() in eval(result)["Choice"].lower():
+    result = llm_run(chat_prompt, model_name, question=question, answer=answer)
+    if 'yes'.lower() in parse_structured(result, 'answer_check', expect=dict)["Choice"].lower():
         return 1
     else:
         return -1
 
 
-def task_execution_mh(data_type, start_index, total_files,
-                      retrieval_num, ind, model_name, dataset,
-                      Tool_dic, test_data, progress_file):
-    with tqdm(total=total_files, desc="Processing files", initial=start_index) as pbar:
-        for i, data in enumerate(test_data[start_index:], start=start_index):
-            answer_ls = []
-            question = data["question"]
-            print(question)
-            temp = task_decompose(question, Tool_dic, model_name)['Tasks']
-            task_ls = []
-            for t in range(len(temp)):
-                task_ls.append({"task": temp[t], "id": t + 1})
-            task_ls = task_topology(question, task_ls, model_name)
-            task_depend = {'Original Question': question}
-            for task_dic in task_ls:
-                task_depend[task_dic['id']] = {'task': task_dic['task'], 'answer': ''}
-            answer_task = []
-            tool_instruction_ls = []
-            api_result_ls = []
-            call_result_ls = []
-            tool_check_reason_ls = []
-            for task_dic in task_ls:
-                task = task_dic['task']
-                print("Do need tool.")
-                tool_used = []
-                depend_id = [1]
-                for r in range(retrieval_num):
-                    if depend_id[0] == -1:
-                        tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
-                                                                                                        dataset,
-                                                                                                        tool_used, ind,
-                                                                                                        model_name)
-                        if len(str(call_result)) > 5000:
-                            call_result = str(call_result)[:5000]
-                        answer = answer_generation(task, API_instruction, call_result, model_name)
-                    else:
-                        previous_log = task_depend
-                        tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
-                                                                                                        dataset,
-                                                                                                        tool_used, ind,
-                                                                                                        model_name,
-                                                                                                        previous_log=previous_log)
-                        if len(str(call_result)) > 5000:
-                            call_result = str(call_result)[:5000]
-                        answer = answer_generation_depend(task, API_instruction, call_result, previous_log, model_name)
-
-                    check_index = 1
-                    if str(call_result).strip() == '-1' or str(call_result).strip() == '':
-                        check_index = -1
-                    if check_index == 1:
-                        answer_task.append({'task': task, 'answer': answer})
-                        tool_instruction_ls.append(tool_instruction)
-                        api_result_ls.append(api_result)
-                        call_result_ls.append(call_result)
-                        break
-                    else:
-                        answer_ls.append({'task': task, 'answer': answer})
-                        try:
-                            tool_used.append(str(tool_id["ID"]))
-                        except:
-                            continue
-                        print('****Try Again****')
-
-                task_depend[task_dic['id']]['answer'] = answer
-            final_answer = answer_summarize(question, answer_task, model_name)
-            check_index = answer_check(question, final_answer, model_name)
-            ind = ind + 1
-            with open(f"FuncQA_{data_type}_{model_name}_easytool.jsonl", 'a+', encoding='utf-8') as f:
-                line = json.dumps({
-                    "ID": ind,
-                    "question": question,
-                    "final_answer": final_answer,
-                    "subtask": task_ls,
-                    "answer_subtask": answer_task,
-                    "answer_wrong": answer_ls,
-                    "check_index": check_index,
-                    "execute_log": {
-                        "api_result_ls": api_result_ls,
-                        "call_result_ls": call_result_ls,
-                        "tool_check_reason_ls": tool_check_reason_ls,
-                        "tool_instruction_ls": tool_instruction_ls,
-                    },
-                    "check": 0
-                }, ensure_ascii=False)
-                f.write(line + '\n')
-
-            print(final_answer)
-            update_progress(progress_file, i + 1)
-            pbar.update(1)
-
-
-def task_execution_oh(data_type, start_index, total_files,
-                      retrieval_num, ind, model_name, dataset,
-                      Tool_dic, test_data, progress_file):
-    with tqdm(total=total_files, desc="Processing files", initial=start_index) as pbar:
-        for i, data in enumerate(test_data[start_index:], start=start_index):
-            answer_ls = []
-            question = data["question"]
-            print(question)
-            task_ls = [{"task": question}]
-            answer_task = []
-            tool_instruction_ls = []
-            api_result_ls = []
-            call_result_ls = []
-            tool_check_reason_ls = []
-            for task_dic in task_ls:
-                task = task_dic['task']
-                print("Do need tool.")
-                tool_used = []
-                depend_id = [1]
-                for r in range(retrieval_num):
-                    tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
-                                                                                                    dataset,
-                                                                                                    tool_used, ind,
-                                                                                                    model_name)
-                    if len(str(call_result)) > 5000:
-                        call_result = str(call_result)[:5000]
-                    answer = answer_generation(task, API_instruction, call_result, model_name)
-
-                    check_index = 1
-                    if str(call_result).strip() == '-1' or str(call_result).strip() == '':
-                        check_index = -1
-                    if check_index == 1:
-                        answer_task.append({'task': task, 'answer': answer})
-                        tool_instruction_ls.append(tool_instruction)
-                        api_result_ls.append(api_result)
-                        call_result_ls.append(call_result)
-                        break
-                    else:
-                        answer_ls.append({'task': task, 'answer': answer})
-                        try:
-                            tool_used.append(str(tool_id["ID"]))
-                        except:
-                            continue
-                        print('****Try Again****')
-
-            final_answer = answer_summarize(question, answer_task, model_name)
-            check_index = answer_check(question, final_answer, model_name)
-            ind = ind + 1
-            with open(f"FuncQA_{data_type}_{model_name}_easytool.jsonl", 'a+', encoding='utf-8') as f:
-                line = json.dumps({
-                    "ID": ind,
-                    "question": question,
-                    "final_answer": final_answer,
-                    "subtask": task_ls,
-                    "answer_subtask": answer_task,
-                    "answer_wrong": answer_ls,
-                    "check_index": check_index,
-                    "execute_log": {
-                        "api_result_ls": api_result_ls,
-                        "call_result_ls": call_result_ls,
-                        "tool_check_reason_ls": tool_check_reason_ls,
-                        "tool_instruction_ls": tool_instruction_ls,
-                    },
-                    "check": 0
-                }, ensure_ascii=False)
-                f.write(line + '\n')
-
-            print(final_answer)
-            update_progress(progress_file, i + 1)
-            pbar.update(1)
-
+@traced
+def subtask_execution(task_dic, task_depend, retrieval_num, ind, model_name, dataset, Tool_dic):
+    task = task_dic['task']
+    answer_ls = []
+    answer_task = []
+    tool_instruction_ls = []
+    api_result_ls = []
+    call_result_ls = []
+    print("Do need tool.")
+    tool_used = []
+    depend_id = [1]
+    for r in range(retrieval_num):
+        if depend_id[0] == -1:
+            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
+                                                                                            dataset,
+                                                                                            tool_used, ind,
+                                                                                            model_name)
+            if len(str(call_result)) > 5000:
+                call_result = str(call_result)[:5000]
+            answer = answer_generation(task, API_instruction, call_result, model_name)
+        else:
+            # Pass only the logs of the subtasks this one depends on, which are already answered.
+            previous_log = {'Original Question': task_depend['Original Question']}
+            for ids in task_dic['dep']:
+                if ids in task_depend:
+                    previous_log[ids] = task_depend[ids]
+            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
+                                                                                            dataset,
+                                                                                            tool_used, ind,
+                                                                                            model_name,
+                                                                                            previous_log=previous_log)
+            if len(str(call_result)) > 5000:
+                call_result = str(call_result)[:5000]
+            answer = answer_generation_depend(task, API_instruction, call_result, previous_log, model_name)
+
+        check_index = 1
+        if str(call_result).strip() == '-1' or str(call_result).strip() == '':
+            check_index = -1
+        if check_index == 1:
+            answer_task.append({'task': task, 'answer': answer})
+            tool_instruction_ls.append(tool_instruction)
+            api_result_ls.append(api_result)
+            call_result_ls.append(call_result)
+            break
+        else:
+            answer_ls.append({'task': task, 'answer': answer})
+            try:
+                tool_used.append(str(tool_id["ID"]))
+            except:
+                continue
+            print('****Try Again****')
+
+    task_depend[task_dic['id']]['answer'] = answer
+    return {
+        "answer_task": answer_task,
+        "answer_wrong": answer_ls,
+        "tool_instruction_ls": tool_instruction_ls,
+        "api_result_ls": api_result_ls,
+        "call_result_ls": call_result_ls,
+    }
+
+
+def query_execution_mh(i, data, retrieval_num, model_name, dataset, Tool_dic):
+    question = data["question"]
+    print(question)
+    temp = task_decompose(question, Tool_dic, model_name)['Tasks']
+    task_ls = []
+    for t in range(len(temp)):
+        task_ls.append({"task": temp[t], "id": t + 1})
+    task_ls = task_topology(question, task_ls, model_name)
+    task_depend = {'Original Question': question}
+    for task_dic in task_ls:
+        task_depend[task_dic['id']] = {'task': task_dic['task'], 'answer': ''}
+    subtask_results = execute_task_graph(
+        task_ls, lambda task_dic: subtask_execution(task_dic, task_depend, retrieval_num, i, model_name,
+                                                    dataset, Tool_dic))
+    answer_ls = []
+    answer_task = []
+    tool_instruction_ls = []
+    api_result_ls = []
+    call_result_ls = []
+    tool_check_reason_ls = []
+    for subtask_result in subtask_results:
+        answer_ls.extend(subtask_result["answer_wrong"])
+        answer_task.extend(subtask_result["answer_task"])
+        tool_instruction_ls.extend(subtask_result["tool_instruction_ls"])
+        api_result_ls.extend(subtask_result["api_result_ls"])
+        call_result_ls.extend(subtask_result["call_result_ls"])
+    final_answer = answer_summarize(question, answer_task, model_name)
+    check_index = answer_check(question, final_answer, model_name)
+
+    print(final_answer)
+    return {
+        "ID": i + 1,
+        "question": question,
+        "final_answer": final_answer,
+        "subtask": task_ls,
+        "answer_subtask": answer_task,
+        "answer_wrong": answer_ls,
+        "check_index": check_index,
+        "execute_log": {
+            "api_result_ls": api_result_ls,
+            "call_result_ls": call_result_ls,
+            "tool_check_reason_ls": tool_check_reason_ls,
+            "tool_instruction_ls": tool_instruction_ls,
+        },
+        "check": 0
+    }
+
+
+def query_execution_oh(i, data, retrieval_num, model_name, dataset, Tool_dic):
+    ind = i
+    answer_ls = []
+    question = data["question"]
+    print(question)
+    task_ls = [{"task": question}]
+    answer_task = []
+    tool_instruction_ls = []
+    api_result_ls = []
+    call_result_ls = []
+    tool_check_reason_ls = []
+    for task_dic in task_ls:
+        task = task_dic['task']
+        print("Do need tool.")
+        tool_used = []
+        depend_id = [1]
+        for r in range(retrieval_num):
+            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task, Tool_dic,
+                                                                                            dataset,
+                                                                                            tool_used, ind,
+                                                                                            model_name)
+            if len(str(call_result)) > 5000:
+                call_result = str(call_result)[:5000]
+            answer = answer_generation(task, API_instruction, call_result, model_name)
+
+            check_index = 1
+            if str(call_result).strip() == '-1' or str(call_result).strip() == '':
+                check_index = -1
+            if check_index == 1:
+                answer_task.append({'task': task, 'answer': answer})
+                tool_instruction_ls.append(tool_instruction)
+                api_result_ls.append(api_result)
+                call_result_ls.append(call_result)
+                break
+            else:
+                answer_ls.append({'task': task, 'answer': answer})
+                try:
+                    tool_used.append(str(tool_id["ID"]))
+                except:
+                    continue
+                print('****Try Again****')
+
+    final_answer = answer_summarize(question, answer_task, model_name)
+    check_index = answer_check(question, final_answer, model_name)
+
+    print(final_answer)
+    return {
+        "ID": i + 1,
+        "question": question,
+        "final_answer": final_answer,
+        "subtask": task_ls,
+        "answer_subtask": answer_task,
+        "answer_wrong": answer_ls,
+        "check_index": check_index,
+        "execute_log": {
+            "api_result_ls": api_result_ls,
+            "call_result_ls": call_result_ls,
+            "tool_check_reason_ls": tool_check_reason_ls,
+            "tool_instruction_ls": tool_instruction_ls,
+        },
+        "check": 0
+    }
+
+
+def task_execution_mh(data_type, retrieval_num, model_name, dataset,
+                      Tool_dic, test_data, progress_file, workers=1, shard=None):
+    load_funchub(dataset)
+    execute_queries(test_data,
+                    lambda i, data: query_execution_mh(i, data, retrieval_num, model_name, dataset, Tool_dic),
+                    f"FuncQA_{data_type}_{model_name}_easytool.jsonl", progress_file, workers, shard)
+    print(f"Parse failures: {parse_stats()}")
+
+
+def task_execution_oh(data_type, retrieval_num, model_name, dataset,
+                      Tool_dic, test_data, progress_file, workers=1, shard=None):
+    load_funchub(dataset)
+    execute_queries(test_data,
+                    lambda i, data: query_execution_oh(i, data, retrieval_num, model_name, dataset, Tool_dic),
+                    f"FuncQA_{data_type}_{model_name}_easytool.jsonl", progress_file, workers, shard)
+    print(f"Parse failures: {parse_stats()}")
@@ -0,0 +1,154 @@
+# — coding: utf-8 –
+import asyncio
+import atexit
+import os
+import threading
+import aiohttp
+import openai
+from cache import *
+from archive import *
+from retry import *
+from tracing import *
+
+openai.api_key = os.environ["OPENAI_API_KEY"]
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+class LLMCacheMiss(ReplayMiss):
+    """Raised in replay mode when a request is not in the response cache."""
+
+
+class LLMClient:
+    """Chat completion client shared by every stage of every task.
+
+    Chat and embedding requests from all threads are multiplexed on one background event loop over one
+    keep-alive aiohttp session, with at most max_inflight requests on the wire and, when rpm or
+    tpm are set, within those requests and tokens per minute. Rate limit, timeout and server
+    errors are retried with jittered exponential backoff that honours Retry-After. With a cache,
+    responses are looked up by model, messages, sampling parameters and retry attempt first;
+    in replay mode the cache is read-only and a miss raises LLMCacheMiss.
+    """
+
+    def __init__(self, max_inflight=64, temperature=0.7, max_retries=6, cache=None, replay=False, rpm=0, tpm=0):
+        self.max_inflight = max_inflight
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.cache = cache
+        self.replay = replay
+        self.limiter = RateLimiter(rpm, tpm)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_inflight))
+
+    async def achat(self, messages, model_name, attempt=0, **params):
+        """Return (response, cached), cached being True when the response came from the cache."""
+        params.setdefault("temperature", self.temperature)
+        if self.cache is not None:
+            key = cache_key(model_name, messages, params, attempt)
+            response = await asyncio.to_thread(self.cache.get, key)
+            if response is not None:
+                return response, True
+            if self.replay:
+                raise LLMCacheMiss(f"no cached response for {model_name} request {key}")
+        response = await self._acreate(messages, model_name, **params)
+        if self.cache is not None:
+            response = response.to_dict_recursive()
+            await asyncio.to_thread(self.cache.set, key, response)
+        return response, False
+
+    async def _acreate(self, messages, model_name, **params):
+        # About four characters per token, plus room for the completion.
+        estimated = sum(len(message["content"]) for message in messages) // 4 + params.get("max_tokens", 512)
+        return await self._arequest(openai.ChatCompletion.acreate, estimated,
+                                    model=model_name, messages=messages, **params)
+
+    async def aembed(self, texts, model_name):
+        return await self._arequest(openai.Embedding.acreate, sum(len(text) for text in texts) // 4,
+                                    engine=model_name, input=texts)
+
+    async def _arequest(self, create, estimated, **kwargs):
+        # openai.aiosession is a ContextVar, so it has to be set inside every request task.
+        openai.aiosession.set(self._session)
+        retries = 0
+        while True:
+            await self.limiter.acquire(estimated)
+            try:
+                async with self._semaphore:
+                    response = await create(**kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind not in TRANSIENT:
+                    raise
+                if retries >= self.max_retries:
+                    # retry_call must not start another round of retries on top of these.
+                    e.retries_exhausted = True
+                    raise
+                delay = backoff_delay(retries, retry_after(e))
+                if kind == RATE_LIMIT:
+                    self.limiter.pause(delay)
+                await asyncio.sleep(delay)
+                retries += 1
+                continue
+            self.limiter.settle(estimated, response.get("usage", {}).get("total_tokens", estimated))
+            return response
+
+    def submit(self, messages, model_name, attempt=0, **params):
+        """Schedule achat on the client loop and return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.achat(messages, model_name, attempt, **params), self._loop)
+
+    def chat(self, messages, model_name, attempt=0, **params):
+        return self.submit(messages, model_name, attempt, **params).result()
+
+    def embed(self, texts, model_name):
+        """Embed texts in one request, within the same limits and retries as chat requests."""
+        return asyncio.run_coroutine_threadsafe(self.aembed(texts, model_name), self._loop).result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            cache = get_archive()
+            replay = replaying()
+            if cache is None and os.environ.get("EASYTOOL_LLM_CACHE"):
+                replay = os.environ.get("EASYTOOL_LLM_CACHE_MODE") == "replay"
+                max_mb = os.environ.get("EASYTOOL_LLM_CACHE_MAX_MB")
+                cache = SQLiteCache(os.environ["EASYTOOL_LLM_CACHE"],
+                                    max_bytes=int(float(max_mb) * 2 ** 20) if max_mb else None,
+                                    readonly=replay)
+            _client = LLMClient(max_inflight=int(os.environ.get("EASYTOOL_MAX_INFLIGHT", 64)),
+                                cache=cache, replay=replay,
+                                rpm=float(os.environ.get("EASYTOOL_RPM", 0)),
+                                tpm=float(os.environ.get("EASYTOOL_TPM", 0)))
+            atexit.register(_client.close)
+    return _client
+
+
+def prompt_messages(chat_prompt, **kwargs):
+    return [{"role": _ROLES[message.type], "content": message.content}
+            for message in chat_prompt.format_messages(**kwargs)]
+
+
+def llm_run(chat_prompt, model_name, attempt=0, **kwargs):
+    """Render chat_prompt with kwargs and return the completion text, like LLMChain.run.
+
+    attempt is the retry number of the calling stage, so that a retry after an unusable
+    answer is not served the same cached response again.
+    """
+    response, cached = get_llm_client().chat(prompt_messages(chat_prompt, **kwargs), model_name, attempt)
+    add_tokens(response.get("usage"), cached)
+    return response["choices"][0]["message"]["content"]
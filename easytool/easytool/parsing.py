@@ -0,0 +1,115 @@
+# — coding: utf-8 –
+import ast
+import json
+import re
+import threading
+from collections import Counter
+
+_OPEN = {'{': '}', '[': ']'}
+# String literals are matched first so that the repairs below never touch their contents.
+_STRING = r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\''
+_LITERALS = {'true': 'True', 'false': 'False', 'null': 'None'}
+_REPAIR = re.compile(_STRING + r'|\b(?:true|false|null)\b|,(?=\s*[}\]])')
+_SMART_QUOTES = str.maketrans({'\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'"})
+
+parse_failures = Counter()
+parse_repairs = Counter()
+_stats_lock = threading.Lock()
+
+
+class ParseError(ValueError):
+    pass
+
+
+def find_blocks(text):
+    """Yield every balanced {...} or [...] block of text, outermost only, in order."""
+    start = 0
+    while start < len(text):
+        if text[start] not in _OPEN:
+            start += 1
+            continue
+        stack = []
+        quote = None
+        end = None
+        pos = start
+        while pos < len(text):
+            char = text[pos]
+            if quote:
+                if char == '\\':
+                    pos += 1
+                elif char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+            elif char in _OPEN:
+                stack.append(_OPEN[char])
+            elif char in '}]':
+                if char != stack.pop():
+                    break
+                if not stack:
+                    end = pos + 1
+                    break
+            pos += 1
+        if end is None:
+            start += 1
+            continue
+        yield text[start:end]
+        start = end
+
+
+def _repair(text):
+    def fix(match):
+        token = match.group(0)
+        if token == ',':
+            return ''
+        return _LITERALS.get(token, token)
+    return _REPAIR.sub(fix, text)
+
+
+def _literal(candidate):
+    """Parse candidate as JSON or a Python literal; returns (value, repaired)."""
+    try:
+        return json.loads(candidate), False
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(candidate), False
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        pass
+    for repaired in (_repair(candidate), _repair(candidate.translate(_SMART_QUOTES))):
+        try:
+            return ast.literal_eval(repaired), True
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            pass
+    raise ParseError(f"Cannot parse {candidate[:80]!r}")
+
+
+def parse_structured(text, stage, expect=(dict, list), last=False):
+    """Parse the structured answer out of an LLM output.
+
+    The balanced JSON objects or lists in text are tried in order (last first with last=True),
+    each as JSON, as a Python literal and after repairing true/false/null, trailing commas and
+    smart quotes. A bare value such as a quoted string is accepted when no block parses. Raises
+    ParseError, counted under stage, when no candidate yields a value of type expect.
+    """
+    text = str(text).replace('```json', '').replace('```', '').strip()
+    blocks = list(find_blocks(text))
+    for candidate in (blocks[::-1] if last else blocks) + [text]:
+        try:
+            value, repaired = _literal(candidate)
+        except ParseError:
+            continue
+        if isinstance(value, expect):
+            if repaired:
+                with _stats_lock:
+                    parse_repairs[stage] += 1
+            return value
+    with _stats_lock:
+        parse_failures[stage] += 1
+    raise ParseError(f"{stage}: no parsable answer in {text[:80]!r}")
+
+
+def parse_stats():
+    with _stats_lock:
+        return {stage: {"failures": parse_failures[stage], "repaired": parse_repairs[stage]}
+                for stage in sorted(set(parse_failures) | set(parse_repairs))}
@@ -4,14 +4,12 @@ import json
 import logging
 import sys
 import argparse
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate
 )
-from langchain import LLMChain
 import numpy as np
 import requests
 import os
@@ -21,30 +19,19 @@ import importlib.util
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 from util import *
+from llm import *
+from parsing import *
+from retry import *
+from tracing import *
+from scheduler import *
 
 from tqdm import tqdm
 
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
 
-def get_last_processed_index(progress_file):
-    """Retrieve the last processed index from the progress file."""
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            last_index = f.read().strip()
-            return int(last_index) if last_index else 0
-    else:
-        return 0
-
-
-def update_progress(progress_file, index):
-    """Update the last processed index in the progress file."""
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        f.write(str(index))
-
-
+@traced
 def task_decompose(question, Tool_dic, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -65,46 +52,37 @@ def task_decompose(question, Tool_dic, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question, Tool_dic=Tool_dic)
-            result = eval(result.split('\n\n')[0])
-            break
-        except Exception as e:
-            print(f"task decompose fails: {e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question, Tool_dic=Tool_dic, attempt=ind)
+        result = parse_structured(result, 'task_decompose', expect=list)
+        return result
+    return retry_call("task decompose", attempt)
+
+
+def query_execution(i, data, Tool_dic, dic_tool, model_name):
+    question = data["query"]
+    print(question)
+    task_path = task_decompose(question, Tool_dic, model_name)
+    tool_choice_ls = []
+    for task in task_path:
+        if isinstance(task["ID"], list):
+            for ele in task["ID"]:
+                tool_choice_ls.append(dic_tool[ele]['tool_usage'])
+        elif int(task["ID"]) in dic_tool.keys():
+            tool_choice_ls.append(dic_tool[task["ID"]]['tool_usage'])
+    print(tool_choice_ls)
+    return {
+        "ID": i + 1,
+        "question": question,
+        "task_path": task_path,
+        "tool_choice_ls": tool_choice_ls
+    }
 
 
 def task_execution(
         Tool_dic, dic_tool, test_data, progress_file,
-        start_index, total_files, retrieval_num, ind, model_name):
-    with tqdm(total=total_files, desc="Processing files", initial=start_index) as pbar:
-        for i, data in enumerate(test_data[start_index:], start=start_index):
-            question = data["query"]
-            print(question)
-            task_path = task_decompose(question, Tool_dic, model_name)
-            tool_choice_ls = []
-            for task in task_path:
-                if isinstance(task["ID"], list):
-                    for ele in task["ID"]:
-                        tool_choice_ls.append(dic_tool[ele]['tool_usage'])
-                elif int(task["ID"]) in dic_tool.keys():
-                    tool_choice_ls.append(dic_tool[task["ID"]]['tool_usage'])
-            ind = ind + 1
-            with open(f"restbench_{model_name}_Easytool.jsonl", 'a+', encoding='utf-8') as f:
-                line = json.dumps({
-                    "ID": ind,
-                    "question": question,
-                    "task_path": task_path,
-                    "tool_choice_ls": tool_choice_ls
-                }, ensure_ascii=False)
-                f.write(line + '\n')
-            print(tool_choice_ls)
-            update_progress(progress_file, i + 1)
-            pbar.update(1)
+        retrieval_num, model_name, workers=1, shard=None):
+    execute_queries(test_data,
+                    lambda i, data: query_execution(i, data, Tool_dic, dic_tool, model_name),
+                    f"restbench_{model_name}_Easytool.jsonl", progress_file, workers, shard)
+    print(f"Parse failures: {parse_stats()}")
@@ -0,0 +1,291 @@
+# — coding: utf-8 –
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import numpy as np
+
+# Rows of a float16 store are upcast in chunks of this size while scoring.
+SCORE_CHUNK = 8192
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Column indices of the k highest scores of every row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+class EmbeddingRetriever:
+    """Exact cosine-similarity search over tool embeddings.
+
+    The embeddings are normalized once and kept as one contiguous float32 matrix, so a batch
+    of queries is scored with a single matrix product and only the top k are sorted. A matrix
+    that is already normalized, such as a memory-mapped store, is used as is.
+    """
+
+    def __init__(self, embedded_texts, filenames, normalized=False):
+        if normalized:
+            self.matrix = embedded_texts
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(np.asarray(embedded_texts, dtype=np.float32)))
+        self.filenames = list(filenames)
+
+    def scores(self, queries):
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        scores = np.empty((len(queries), len(self.matrix)), dtype=np.float32)
+        for start in range(0, len(self.matrix), SCORE_CHUNK):
+            chunk = np.asarray(self.matrix[start:start + SCORE_CHUNK], dtype=np.float32)
+            scores[:, start:start + SCORE_CHUNK] = queries @ chunk.T
+        return scores
+
+    def search(self, query_embedding, k):
+        return self.search_batch([query_embedding], k)[0]
+
+    def search_batch(self, query_embeddings, k):
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        scores = self.scores(queries)
+        return [[self.filenames[j] for j in row] for row in top_k(scores, k)]
+
+
+class IVFIndex:
+    """Approximate search with an inverted-file index over an EmbeddingRetriever.
+
+    Spherical k-means splits the normalized embeddings into n_lists clusters; a query only
+    scores the rows of its nprobe closest clusters. Raising nprobe trades latency for recall,
+    and nprobe == n_lists is an exact search.
+    """
+
+    def __init__(self, retriever, centroids, order, offsets, nprobe=8, fingerprint=None):
+        self.retriever = retriever
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, retriever, n_lists=None, iterations=10, nprobe=8, seed=0):
+        matrix = retriever.matrix
+        n = len(matrix)
+        n_lists = min(n_lists or max(int(np.sqrt(n)), 1), n)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, n_lists * 256), replace=False))
+        train = np.asarray(matrix[sample], dtype=np.float32)
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=n_lists)
+            empty = counts == 0
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, SCORE_CHUNK):
+            chunk = np.asarray(matrix[start:start + SCORE_CHUNK], dtype=np.float32)
+            assign[start:start + SCORE_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        return cls(retriever, centroids, order, offsets, nprobe, matrix_fingerprint(matrix))
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 fingerprint=np.array(self.fingerprint or ""))
+
+    @classmethod
+    def load(cls, retriever, path, nprobe=8):
+        data = np.load(path)
+        fingerprint = str(data["fingerprint"]) if "fingerprint" in data.files else None
+        return cls(retriever, data["centroids"], data["order"], data["offsets"], nprobe, fingerprint)
+
+    def search(self, query_embedding, k):
+        return self.search_batch([query_embedding], k)[0]
+
+    def search_batch(self, query_embeddings, k):
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        probes = top_k(queries @ self.centroids.T, self.nprobe)
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+            rows.sort()
+            scores = np.asarray(self.retriever.matrix[rows], dtype=np.float32) @ query
+            results.append([self.retriever.filenames[rows[j]] for j in top_k(scores[None, :], k)[0]])
+        return results
+
+
+def matrix_fingerprint(matrix):
+    """Hash of an embedding matrix, read in chunks so that a memory-mapped store is not loaded at once."""
+    digest = hashlib.sha256(f"{matrix.shape}{matrix.dtype}".encode('utf-8'))
+    for start in range(0, len(matrix), SCORE_CHUNK):
+        digest.update(np.ascontiguousarray(matrix[start:start + SCORE_CHUNK]).tobytes())
+    return digest.hexdigest()
+
+
+def load_ivf_index(retriever, store_path, nprobe=8):
+    """Load the IVF index saved next to the embeddings, building and saving it when missing or outdated."""
+    path = store_path + '.ivf.npz'
+    if os.path.exists(path):
+        index = IVFIndex.load(retriever, path, nprobe)
+        if index.fingerprint == matrix_fingerprint(retriever.matrix):
+            return index
+    index = IVFIndex.build(retriever, nprobe=nprobe)
+    index.save(path)
+    return index
+
+
+def tokenize(text):
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(text))
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+class BM25Retriever:
+    """Okapi BM25 over each tool's name, description and API names; no network needed."""
+
+    def __init__(self, doc_ids, postings, doc_lengths, k1=1.5, b=0.75, fingerprint=None):
+        self.doc_ids = doc_ids
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, dataset, k1=1.5, b=0.75):
+        doc_ids = list(dataset.keys())
+        postings = {}
+        doc_lengths = np.zeros(len(doc_ids), dtype=np.float32)
+        for doc, tool_id in enumerate(doc_ids):
+            tool = dataset[tool_id]
+            terms = tokenize(tool.get("tool_name", "")) + tokenize(tool.get("tool_description", ""))
+            for api_name in tool.get("tool_guidelines", {}):
+                terms += tokenize(api_name)
+            doc_lengths[doc] = len(terms)
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc)
+                postings[term][1].append(count)
+        postings = {term: (np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.float32))
+                    for term, (docs, tfs) in postings.items()}
+        return cls(doc_ids, postings, doc_lengths, k1, b, dataset_fingerprint(dataset))
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            pickle.dump((self.doc_ids, self.postings, self.doc_lengths, self.k1, self.b, self.fingerprint), file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls(*pickle.load(file))
+
+    def scores(self, question):
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        n = len(self.doc_ids)
+        for term in set(tokenize(question)):
+            if term not in self.postings:
+                continue
+            docs, tfs = self.postings[term]
+            idf = np.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def search(self, question, k):
+        return self.search_batch([question], k)[0]
+
+    def search_batch(self, questions, k):
+        if not questions:
+            return []
+        scores = np.stack([self.scores(question) for question in questions])
+        return [[self.doc_ids[j] for j in row] for row in top_k(scores, k)]
+
+
+def dataset_fingerprint(dataset):
+    """Hash of the tool fields BM25Retriever indexes, to tell whether a saved index is outdated."""
+    digest = hashlib.sha256()
+    for tool_id, tool in dataset.items():
+        digest.update(json.dumps([tool_id, tool.get("tool_name", ""), tool.get("tool_description", ""),
+                                  list(tool.get("tool_guidelines", {}))], ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_bm25_index(dataset, path):
+    """Load the BM25 index persisted at path, building and saving it when missing or outdated."""
+    if os.path.exists(path):
+        index = BM25Retriever.load(path)
+        if index.fingerprint == dataset_fingerprint(dataset):
+            return index
+    index = BM25Retriever.build(dataset)
+    index.save(path)
+    return index
+
+
+class HybridRetriever:
+    """Fuse a lexical and a dense ranking with reciprocal rank fusion."""
+
+    def __init__(self, lexical, dense, depth=50, rrf_k=60):
+        self.lexical = lexical
+        self.dense = dense
+        self.depth = depth
+        self.rrf_k = rrf_k
+
+    def search_batch(self, questions, query_embeddings, k):
+        results = []
+        for lexical, dense in zip(self.lexical.search_batch(questions, self.depth),
+                                  self.dense.search_batch(query_embeddings, self.depth)):
+            fused = {}
+            for ranking in (lexical, dense):
+                for rank, tool_id in enumerate(ranking):
+                    fused[str(tool_id)] = fused.get(str(tool_id), 0) + 1 / (self.rrf_k + rank + 1)
+            results.append(sorted(fused, key=lambda tool_id: fused[tool_id], reverse=True)[:k])
+        return results
+
+
+def convert_embeddings(pkl_path, store_path, dtype='float32'):
+    """Convert a pickled (filenames, embeddings) pair into a normalized .npy store.
+
+    The vectors go to store_path + '.npy' and the filenames to the sidecar store_path + '.json'.
+    """
+    with open(pkl_path, "rb") as file:
+        filenames, embedded_texts = pickle.load(file)
+    matrix = normalize_rows(np.asarray(embedded_texts, dtype=np.float32)).astype(dtype)
+    np.save(store_path + '.npy', matrix)
+    with open(store_path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({"filenames": list(filenames), "dtype": dtype}, f, ensure_ascii=False)
+
+
+def has_embedding_store(store_path):
+    return os.path.exists(store_path + '.npy') and os.path.exists(store_path + '.json')
+
+
+def load_embedding_store(store_path):
+    """Open a store written by convert_embeddings; the vectors are memory-mapped, not read."""
+    matrix = np.load(store_path + '.npy', mmap_mode='r')
+    with open(store_path + '.json', 'r', encoding='utf-8') as f:
+        filenames = json.load(f)["filenames"]
+    return EmbeddingRetriever(matrix, filenames, normalized=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert API_description_embeddings.pkl into a .npy store")
+    parser.add_argument('--pkl', type=str, default='data_toolbench/tool_instruction/API_description_embeddings.pkl')
+    parser.add_argument('--store', type=str, default='data_toolbench/tool_instruction/API_description_embeddings')
+    parser.add_argument('--dtype', type=str, default='float32', help='float32 or float16')
+    args = parser.parse_args()
+    convert_embeddings(args.pkl, args.store, args.dtype)
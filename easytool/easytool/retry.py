@@ -0,0 +1,129 @@
+# — coding: utf-8 –
+import asyncio
+import random
+import time
+import openai
+from archive import *
+from tracing import *
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+SERVER = "server"
+PARSE = "parse"
+OTHER = "other"
+# Errors worth waiting for: the same request is likely to succeed a little later.
+TRANSIENT = (RATE_LIMIT, TIMEOUT, SERVER)
+
+
+def classify_error(e):
+    if isinstance(e, openai.error.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(e, (openai.error.Timeout, asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(e, (openai.error.APIConnectionError, openai.error.ServiceUnavailableError)):
+        return SERVER
+    if isinstance(e, openai.error.APIError) and (e.http_status is None or e.http_status >= 500):
+        return SERVER
+    # An answer that parsed but lacks the expected keys or types is as unusable as one that did not parse.
+    if isinstance(e, (ValueError, KeyError, IndexError, TypeError, AttributeError)):
+        return PARSE
+    return OTHER
+
+
+def retry_after(e):
+    """Seconds the server asked us to wait, from the Retry-After headers of an API error."""
+    headers = getattr(e, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(retries, server_delay=None, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter, never shorter than what the server asked for."""
+    delay = random.uniform(0, min(cap, base * 2 ** retries))
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    return delay
+
+
+def retry_call(stage, attempt_fn, max_attempts=12, default=-1):
+    """Call attempt_fn(ind) for ind = 0, 1, ... until it returns, or return default.
+
+    Unusable answers are asked for again right away, with ind passed on so that the retry is
+    not served the same cached response, and transient errors after a backoff; an error the
+    LLM client already retried until it gave up ends the loop at once. Any other error, such as
+    a rejected request or a replay miss, would fail again the same way and is raised.
+    """
+    for ind in range(max_attempts):
+        try:
+            return attempt_fn(ind)
+        except ReplayMiss:
+            # Replay cannot go on without the recorded answer, and asking again would not find it.
+            raise
+        except Exception as e:
+            kind = classify_error(e)
+            print(f"{stage} fails ({kind}): {e}")
+            if kind == OTHER:
+                annotate(outcome="error")
+                raise
+            count_retry()
+            if getattr(e, "retries_exhausted", False):
+                # The LLM client already backed off and retried this error as often as allowed.
+                break
+            if ind + 1 < max_attempts and kind in TRANSIENT:
+                time.sleep(backoff_delay(ind, retry_after(e)))
+    annotate(outcome="failed")
+    return default
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by all requests of a client.
+
+    Each bucket holds at most ten seconds of its rate, so a burst at start-up cannot use up a
+    whole minute of quota at once; the request bucket holds at least one request, so rates
+    below 6 RPM still get through. Token use is estimated before a request and corrected with
+    the reported usage afterwards. pause() holds every request back after a rate limit error.
+    All methods run on the client's event loop.
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = max(rpm / 6, 1)
+        self._tokens = tpm / 6
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(max(self.rpm / 6, 1), self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm / 6, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens):
+        while True:
+            self._refill()
+            wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                # A request larger than the bucket is let through once the bucket is full.
+                needed = min(tokens, self.tpm / 6)
+                wait = max(0 if not self.rpm else (1 - self._requests) * 60 / self.rpm,
+                           0 if not self.tpm else (needed - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    self._requests -= 1 if self.rpm else 0
+                    self._tokens -= tokens if self.tpm else 0
+                    return
+            await asyncio.sleep(wait)
+
+    def settle(self, estimated, used):
+        if self.tpm:
+            self._tokens -= used - estimated
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
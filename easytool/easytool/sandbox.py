@@ -0,0 +1,192 @@
+# — coding: utf-8 –
+import atexit
+import builtins
+import contextvars
+import os
+import pickle
+import queue
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.connection import Connection
+from toolenv import *
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+_deadline = contextvars.ContextVar("tool_deadline", default=None)
+
+
+class ToolWorkerCrash(RuntimeError):
+    pass
+
+
+class ToolCallError(RuntimeError):
+    """An exception raised by a tool in a worker whose type does not exist in the parent."""
+
+
+_TOOL_ERRORS = {"ToolNotFound": ToolNotFound, "ToolBindingError": ToolBindingError}
+
+
+def _rebuild_error(name, message, unknown):
+    error = _TOOL_ERRORS.get(name) or getattr(builtins, name, None)
+    if isinstance(error, type) and issubclass(error, Exception):
+        error = error(message)
+    else:
+        error = ToolCallError(f"{name}: {message}")
+    error.unknown_parameters = unknown
+    return error
+
+
+class ToolSandbox:
+    """Warm worker processes that load tool modules and run_tool in them, each with its own module cache.
+
+    A call that outlives its timeout kills the worker; a worker that dies or whose peak RSS
+    grows past max_rss_mb is replaced by a fresh one. Waiting for a free worker counts
+    towards the timeout.
+    """
+
+    def __init__(self, workers=4, call_timeout=30.0, max_rss_mb=1024):
+        self.call_timeout = call_timeout
+        self.max_rss_kb = max_rss_mb * 1024
+        self.calls = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.recycled = 0
+        self._closed = False
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent, child = socket.socketpair()
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(child.fileno())],
+                                   pass_fds=[child.fileno()])
+        child.close()
+        return process, Connection(parent.detach())
+
+    def _retire(self, worker):
+        process, conn = worker
+        process.kill()
+        process.wait()
+        conn.close()
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def call(self, app_path, name, arg, timeout=None):
+        timeout = self.call_timeout if timeout is None else min(timeout, self.call_timeout)
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"No tool worker free within {timeout:.1f}s")
+        with self._lock:
+            self.calls += 1
+        process, conn = worker
+        try:
+            conn.send((app_path, name, arg))
+            reply = conn.recv() if conn.poll(max(deadline - time.monotonic(), 0)) else None
+        except (EOFError, OSError) as e:
+            with self._lock:
+                self.crashes += 1
+            self._retire(worker)
+            raise ToolWorkerCrash(f"Tool worker died while running {name} in {app_path}: {e!r}")
+        if reply is None:
+            with self._lock:
+                self.timeouts += 1
+            self._retire(worker)
+            raise TimeoutError(f"{name} in {app_path} did not return within {timeout:.1f}s")
+        status, payload, rss_kb = reply
+        if self.max_rss_kb and rss_kb > self.max_rss_kb:
+            with self._lock:
+                self.recycled += 1
+            self._retire(worker)
+        else:
+            self._idle.put(worker)
+        if status == "error":
+            raise _rebuild_error(*payload)
+        return payload
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                process, conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            process.wait()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "timeouts": self.timeouts, "crashes": self.crashes,
+                    "recycled": self.recycled}
+
+
+def get_sandbox():
+    """The tool sandbox with EASYTOOL_SANDBOX_WORKERS workers, or None when that is unset or 0."""
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None and int(os.environ.get("EASYTOOL_SANDBOX_WORKERS", 0)) > 0:
+            _sandbox = ToolSandbox(int(os.environ["EASYTOOL_SANDBOX_WORKERS"]),
+                                   float(os.environ.get("EASYTOOL_TOOL_TIMEOUT", 30)),
+                                   float(os.environ.get("EASYTOOL_SANDBOX_MAX_RSS_MB", 1024)))
+            atexit.register(_sandbox.close)
+    return _sandbox
+
+
+@contextmanager
+def tool_deadline(seconds=None):
+    """Limit the tool calls made in the enclosed block, threads started from it included, to seconds in total.
+
+    seconds defaults to EASYTOOL_QUERY_TOOL_TIMEOUT; with neither set there is no limit.
+    """
+    if seconds is None:
+        seconds = float(os.environ.get("EASYTOOL_QUERY_TOOL_TIMEOUT", 0)) or None
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def call_tool(app_path, name, arg):
+    """run_tool in the sandbox when one is configured, so the tool module is never loaded here."""
+    deadline = _deadline.get()
+    remaining = None if deadline is None else deadline - time.monotonic()
+    if remaining is not None and remaining <= 0:
+        raise TimeoutError("The tool call deadline of this query has passed")
+    sandbox = get_sandbox()
+    if sandbox is None:
+        return run_tool(app_path, name, arg)
+    return sandbox.call(app_path, name, arg, remaining)
+
+
+def worker_main(fd):
+    conn = Connection(fd)
+    while True:
+        try:
+            app_path, name, arg = conn.recv()
+        except EOFError:
+            break
+        try:
+            result, unknown = run_tool(app_path, name, arg)
+            try:
+                pickle.dumps(result)
+            except Exception:
+                result = str(result)
+            reply = ("ok", (result, unknown))
+        except Exception as e:
+            reply = ("error", (type(e).__name__, str(e), getattr(e, "unknown_parameters", [])))
+        # ru_maxrss is in kilobytes on Linux.
+        conn.send(reply + (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,))
+
+
+if __name__ == '__main__':
+    worker_main(int(sys.argv[1]))
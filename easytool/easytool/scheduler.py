@@ -0,0 +1,265 @@
+# — coding: utf-8 –
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from tqdm import tqdm
+from util import *
+from archive import *
+from tracing import *
+from sandbox import *
+
+
+def parse_shard(spec):
+    """Parse an 'i/N' shard spec into (i, N)."""
+    index, count = (int(part) for part in spec.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec}, expected i/N with 0 <= i < N")
+    return index, count
+
+
+def shard_path(path, shard):
+    """Per-shard name of an output or progress file, e.g. G2_gpt-4_Easytool.shard0of4.jsonl."""
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard[0]}of{shard[1]}{ext}"
+
+
+class ResultWriter:
+    """Long-lived, append-only writer for a JSONL result file.
+
+    Records are buffered and written in groups followed by a single fsync, after which the
+    progress file is replaced atomically. The result file is the source of truth: on open it is
+    scanned for the IDs already committed, and a torn last line left by a crash is cut off, so
+    every record ends up in the file exactly once. Complete lines that cannot be read are skipped
+    with a warning and left in place.
+    """
+
+    def __init__(self, result_file, progress_file, commit_every=16, commit_interval=2.0):
+        self.result_file = result_file
+        self.progress_file = progress_file
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.done = self._recover()
+        self._buffer = []
+        self._last_commit = time.monotonic()
+        self._file = open(result_file, 'a', encoding='utf-8')
+        update_progress(progress_file, self.done)
+
+    def _recover(self):
+        # Records carry "ID": i + 1, where i is the index of the query in test_data.
+        done = set()
+        if not os.path.exists(self.result_file):
+            return done
+        end = 0
+        with open(self.result_file, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record_id = json.loads(line)["ID"]
+                    if not isinstance(record_id, int):
+                        raise TypeError(f"ID {record_id!r} is not an integer")
+                    done.add(record_id - 1)
+                except (ValueError, KeyError, TypeError) as e:
+                    # A complete line is never cut off, the records after it are kept.
+                    print(f"Warning: skipping unreadable record on line {number} of {self.result_file}: {e!r}")
+            size = f.seek(0, os.SEEK_END)
+        # Only an unterminated last line, left by a torn write, is cut off.
+        if end < size:
+            print(f"Truncating {size - end} bytes of incomplete records from {self.result_file}")
+            with open(self.result_file, 'r+b') as f:
+                f.truncate(end)
+        return done
+
+    def write(self, i, record):
+        self._buffer.append((i, json.dumps(record, ensure_ascii=False) + '\n'))
+        if len(self._buffer) >= self.commit_every or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.commit()
+
+    def commit(self):
+        if self._buffer:
+            self._file.write(''.join(line for _, line in self._buffer))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.done.update(i for i, _ in self._buffer)
+            self._buffer = []
+            update_progress(self.progress_file, self.done)
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+def execute_queries(test_data, query_execution, result_file, progress_file, workers=1, shard=None):
+    """Run query_execution(i, data) over test_data and append every record to result_file once.
+
+    Records are written in test_data order even when queries finish out of order; at most
+    workers * 4 queries past the oldest unwritten one are started, which bounds the records held
+    back. Progress is taken from the records already in result_file, so a resumed run skips
+    exactly those. A query that raises is reported and left out, to be run again on resume;
+    only a ReplayMiss stops the whole run.
+    The spans of each query are added to its execute_log, and with EASYTOOL_TRACE_FILE set
+    the whole run is also written there as a Chrome trace.
+    The tool calls of each query share one deadline, EASYTOOL_QUERY_TOOL_TIMEOUT seconds.
+    With shard=(i, N) only every N-th query starting at i is run, records keep their global
+    IDs, and both files get a per-shard name; merge.py joins the shard outputs again.
+    """
+    result_file = shard_path(result_file, shard)
+    progress_file = shard_path(progress_file, shard)
+    indices = range(len(test_data)) if shard is None else range(shard[0], len(test_data), shard[1])
+    writer = ResultWriter(result_file, progress_file)
+    pending = [i for i in indices if i not in writer.done]
+    trace_file = os.environ.get("EASYTOOL_TRACE_FILE")
+    if trace_file:
+        start_recording()
+
+    def run_query(i, data):
+        with span("query", query=i + 1) as root, tool_deadline():
+            try:
+                record = query_execution(i, data)
+            except ReplayMiss:
+                raise
+            except Exception as e:
+                print(f"Query {i + 1} fails: {e!r}")
+                annotate(outcome="error")
+                return None
+        if isinstance(record.get("execute_log"), dict):
+            record["execute_log"]["spans"] = root.export()
+        return record
+
+    with tqdm(total=len(indices), desc="Processing files", initial=len(indices) - len(pending)) as pbar:
+        def commit(i, record):
+            if record is None:
+                return
+            writer.write(i, record)
+            pbar.update(1)
+
+        if workers <= 1:
+            try:
+                for i in pending:
+                    commit(i, run_query(i, test_data[i]))
+            finally:
+                writer.close()
+                if trace_file:
+                    write_chrome_trace(shard_path(trace_file, shard))
+            return
+
+        window = workers * 4
+        running = {}
+        finished = {}
+        next_submit = 0
+        next_pos = 0
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while next_pos < len(pending):
+                while next_submit < min(next_pos + window, len(pending)):
+                    i = pending[next_submit]
+                    running[executor.submit(run_query, i, test_data[i])] = i
+                    next_submit += 1
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished[running.pop(future)] = future
+                # A ReplayMiss is raised only once the queries before it are written.
+                while next_pos < len(pending) and pending[next_pos] in finished:
+                    commit(pending[next_pos], finished.pop(pending[next_pos]).result())
+                    next_pos += 1
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            writer.close()
+            if trace_file:
+                write_chrome_trace(shard_path(trace_file, shard))
+
+
+def execute_task_graph(task_ls, subtask_execution, workers=None):
+    """Run subtask_execution(task_dic) for every subtask as soon as all of its dependencies are done.
+
+    Dependencies on ids that are not in task_ls (such as -1) are ignored. If the remaining subtasks
+    only depend on each other, they are released one at a time in list order. Results are returned
+    in task_ls order.
+    """
+    task_ids = {task_dic['id'] for task_dic in task_ls}
+    deps = [{dep for dep in task_dic['dep'] if dep in task_ids and dep != task_dic['id']} for task_dic in task_ls]
+    remaining = list(range(len(task_ls)))
+    running = {}
+    done_ids = set()
+    results = [None] * len(task_ls)
+    with ThreadPoolExecutor(max_workers=workers or max(len(task_ls), 1)) as executor:
+        while remaining or running:
+            ready = [pos for pos in remaining if deps[pos] <= done_ids]
+            if not ready and not running:
+                ready = remaining[:1]
+            for pos in ready:
+                remaining.remove(pos)
+                running[run_in_context(executor, subtask_execution, task_ls[pos])] = pos
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pos = running.pop(future)
+                results[pos] = future.result()
+                done_ids.add(task_ls[pos]['id'])
+    return results
+
+
+class SpeculationBudget:
+    """Number of extra speculative attempts the subtasks of one query may still start."""
+
+    def __init__(self, limit):
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        with self._lock:
+            granted = max(min(n, self.remaining), 0)
+            self.remaining -= granted
+            return granted
+
+
+class AttemptCancelled(Exception):
+    pass
+
+
+def check_cancelled(cancelled):
+    """Raise AttemptCancelled once the cancelled event of a speculative attempt is set."""
+    if cancelled is not None and cancelled.is_set():
+        raise AttemptCancelled()
+
+
+def first_accepted(attempts, accept):
+    """Run attempt(cancelled) for every attempt concurrently until one result passes accept.
+
+    Returns the results that finished until then in completion order, the accepted one last.
+    cancelled is a threading.Event set once a result was accepted; attempts should call
+    check_cancelled(cancelled) before each of their stages, and are not waited for once it is set.
+    """
+    cancelled = threading.Event()
+    results = []
+    executor = ThreadPoolExecutor(max_workers=len(attempts))
+    try:
+        futures = [run_in_context(executor, attempt, cancelled) for attempt in attempts]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except AttemptCancelled:
+                continue
+            results.append(result)
+            if accept(result):
+                cancelled.set()
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def fan_out(fn, items, workers=8):
+    """Run fn(item) for every item concurrently and return the results in item order."""
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), workers)) as executor:
+        futures = [run_in_context(executor, fn, item) for item in items]
+        return [future.result() for future in futures]
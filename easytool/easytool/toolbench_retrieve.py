@@ -1,17 +1,16 @@
 # — coding: utf-8 –
+import functools
 import openai
 import json
 import logging
 import sys
 import argparse
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate
 )
-from langchain import LLMChain
 import numpy as np
 import requests
 import os
@@ -21,45 +20,39 @@ import importlib.util
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 from util import *
+from llm import *
+from parsing import *
+from retry import *
+from tracing import *
+from archive import *
+from toolcache import *
+from toolenv import *
+from sandbox import *
+from retriever import *
+from embedding import *
+from scheduler import *
 from tqdm import tqdm
 
 openai.api_key = os.environ["OPENAI_API_KEY"]
 
 
-def get_last_processed_index(progress_file):
-    """Retrieve the last processed index from the progress file."""
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            last_index = f.read().strip()
-            return int(last_index) if last_index else 0
-    else:
-        return 0
-
-
-def update_progress(progress_file, index):
-    """Update the last processed index in the progress file."""
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        f.write(str(index))
-
-
-def get_embedding(text):
-    a = openai.Embedding.create(
-        engine="text-embedding-ada-002",
-        input=text
-    )
-    return a['data'][0]["embedding"]
+@traced
+def retrieve_reference(retriever, question, k):
+    return retrieve_references(retriever, [question], k)[0]
 
 
-def retrieve_reference(embedded_texts, filenames, question, k):
-    input_text = question
-    input_embedding = get_embedding(input_text)
-    similarities = [cosine_similarity([input_embedding], [emb])[0][0] for emb in embedded_texts]
-    top_k_indices = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)[:k]
-    return [filenames[i] for i in top_k_indices]
+def retrieve_references(retriever, questions, k):
+    if not questions:
+        return []
+    if isinstance(retriever, BM25Retriever):
+        return retriever.search_batch(questions, k)
+    if isinstance(retriever, HybridRetriever):
+        return retriever.search_batch(questions, get_embeddings(questions), k)
+    return retriever.search_batch(get_embeddings(questions), k)
 
 
+@traced
 def choose_tool(question, Tool_dic, tool_used, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -76,28 +69,55 @@ def choose_tool(question, Tool_dic, tool_used, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
     Tool_list = []
     for ele in Tool_dic:
         for key in ele.keys():
             if str(key) not in tool_used:
                 Tool_list.append(f'''ID: {key}\n{ele[key]}''')
-    while True:
-        try:
-            result = chain.run(question=question,
-                               Too_list='\n'.join(Tool_list))
-            clean_answer = eval(result.split("\n\n")[-1].strip())
-            break
-        except Exception as e:
-            print(f"choose tool fails:{e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return clean_answer
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  Too_list='\n'.join(Tool_list),
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_tool', expect=dict, last=True)
+        return clean_answer
+    return retry_call("choose tool", attempt)
 
 
+@traced
+def rank_tools(question, Tool_dic, model_name):
+    template = "You are a helpful assistant."
+    system_message_prompt = SystemMessagePromptTemplate.from_template(template)
+    human_message_prompt = HumanMessagePromptTemplate.from_template(
+        "This is the user's question: {question}\n"
+        "These are the tools you can select to solve the question:\n"
+        "Tool List:\n"
+        "{Too_list}\n\n"
+        "Please note that: \n"
+        "1. You should rank the tools in the Tool List by how well they can solve this question, the best first.\n"
+        "2. You must ONLY output the IDs of the tools in a parsible JSON format. An example output looks like:\n"
+        "'''\n"
+        "Example: {{\"IDs\": [XX, XX, XX]}}\n"
+        "'''\n"
+        "Output:"
+    )
+    chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
+    Tool_list = []
+    for ele in Tool_dic:
+        for key in ele.keys():
+            Tool_list.append(f'''ID: {key}\n{ele[key]}''')
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  Too_list='\n'.join(Tool_list),
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'rank_tools', expect=dict, last=True)
+        return [str(tool) for tool in clean_answer["IDs"]]
+    ranking = retry_call("rank tools", attempt, max_attempts=4, default=[])
+    # Tools the ranking leaves out keep their Tool_dic order behind the ranked ones.
+    position = {tool: pos for pos, tool in enumerate(dict.fromkeys(ranking))}
+    return sorted(Tool_dic, key=lambda ele: position.get(str(next(iter(ele))), len(position)))
+
+
+@traced
 def choose_API(API_instruction, API_list, question, model_name):
     input_execute_rapidapi_api_note = '''
 This is an API Tool instruction. Given a question, you should choose APIs from the API list you want to use for this question in this instruction.
@@ -106,7 +126,6 @@ you must only output in a parsible Python List Format. An example output looks l
 ["api1", "api2", ...]
 ```
 '''.strip()
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -123,37 +142,28 @@ you must only output in a parsible Python List Format. An example output looks l
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(API_instruction=API_instruction,
-                               API_list=API_list,
-                               question=question,
-                               input_execute_rapidapi_api_note=input_execute_rapidapi_api_note)
-            clean_answer = eval(result.replace("```", "").strip().split("\n\n")[0].strip())
-            if isinstance(clean_answer, str):
-                ls = [clean_answer]
-            elif isinstance(clean_answer, list):
-                ls = clean_answer
-            temp = []
-            for ele in ls:
-                if ele in API_list:
-                    temp.append(ele)
-            ls = temp
-            return ls
-        except Exception as e:
-            print(f"Choose API fails:{e}")
-            print(result)
-            if ind > 10:
-                return []
-            ind += 1
-            continue
-    return ls
-
-
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, API_instruction=API_instruction,
+                                                  API_list=API_list,
+                                                  question=question,
+                                                  input_execute_rapidapi_api_note=input_execute_rapidapi_api_note,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_API', expect=(list, str))
+        if isinstance(clean_answer, str):
+            ls = [clean_answer]
+        elif isinstance(clean_answer, list):
+            ls = clean_answer
+        temp = []
+        for ele in ls:
+            if ele in API_list:
+                temp.append(ele)
+        ls = temp
+        return ls
+    return retry_call("Choose API", attempt, default=[])
+
+
+@traced
 def choose_parameter(API_instruction, api, api_dic, question, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -173,29 +183,19 @@ def choose_parameter(API_instruction, api, api_dic, question, model_name):
         "Output:\n"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(api_dic=api_dic,
-                               question=question, )
-            clean_answer = eval(
-                result.replace(": true", ": True").replace(":true", ": True").replace(":false", ": False").replace(
-                    ": false", ": False").replace("```", "").strip())
-            a = clean_answer["Parameters"]
-
-            return a
-        except Exception as e:
-            print(f"Choose Parameter fails:{e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return a
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, api_dic=api_dic,
+                                                  question=question,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_parameter', expect=dict)
+        a = clean_answer["Parameters"]
 
+        return a
+    return retry_call("Choose Parameter", attempt)
 
+
+@traced
 def choose_parameter_depend(API_instruction, api, api_dic, question, previous_log, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -217,29 +217,85 @@ def choose_parameter_depend(API_instruction, api, api_dic, question, previous_lo
         "Output:\n"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(api_dic=api_dic,
-                               question=question,
-                               previous_log=previous_log)
-            clean_answer = eval(
-                result.replace(": true", ": True").replace(": false", ": False").replace("```", "").strip())
-            a = clean_answer["Parameters"]
-
-            return a
-        except Exception as e:
-            print(f"choose parameter depend fails:{e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return a
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, api_dic=api_dic,
+                                                  question=question,
+                                                  previous_log=previous_log,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_parameter_depend', expect=dict)
+        a = clean_answer["Parameters"]
+
+        return a
+    return retry_call("choose parameter depend", attempt)
 
 
+@traced
+def choose_plan(question, Tool_dic, dataset, tool_used, model_name, previous_log=None):
+    template = "You are a helpful assistant."
+    system_message_prompt = SystemMessagePromptTemplate.from_template(template)
+    human_message_prompt = HumanMessagePromptTemplate.from_template(
+        "This is the user's question: {question}\n"
+        "These are the tools you can select to solve the question, each with the documentation of its APIs:\n"
+        "Tool List:\n"
+        "{Tool_list}\n\n"
+        + ("There are logs of previous questions and answers: \n {previous_log}\n" if previous_log is not None else "") +
+        "You need to choose the tool, the APIs and their parameters to solve the question in one answer.\n"
+        "Please note that: \n"
+        "1. You should only choose one tool from the Tool List, and only APIs of that tool.\n"
+        "2. The parameters of each API must contain its required parameters, and can contain the optional parameters based on the question. If no paremters in the required parameters and optional parameters, just leave it as {{}}.\n"
+        "3. If you need to use an API multiple times, please set its \"Parameters\" to a list.\n"
+        "4. You must ONLY output in a parsible JSON format. An example output looks like:\n"
+        "'''\n"
+        "Example: {{\"ID\": XX, \"apis\": [{{\"api_name\": \"api1\", \"Parameters\": {{\"keyword\": \"Artificial Intelligence\", \"language\": \"English\"}}}}]}}\n"
+        "'''\n"
+        "Output:"
+    )
+    chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
+    Tool_list = []
+    candidates = set()
+    for ele in Tool_dic:
+        for key in ele.keys():
+            if str(key) not in tool_used and str(key) in dataset:
+                candidates.add(str(key))
+                Tool_list.append(f'''ID: {key}\n{ele[key]}\nAPIs: {json.dumps(dataset[str(key)]["tool_guidelines"], ensure_ascii=False)}''')
+    if len(Tool_list) == 0:
+        return -1
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  Tool_list='\n'.join(Tool_list),
+                                                  previous_log=previous_log,
+                                                  attempt=ind)
+        clean_answer = parse_structured(result, 'choose_plan', expect=dict, last=True)
+        validate_plan(clean_answer, candidates, dataset)
+        return clean_answer
+    # An unusable plan is not asked for again, the staged path takes over instead.
+    plan = retry_call("choose plan", attempt, max_attempts=1)
+    annotate(planning="fused" if plan != -1 else "fallback")
+    return plan
+
+
+def validate_plan(plan, candidates, dataset):
+    """Raise ValueError unless plan calls APIs of one of the candidate tools with their required parameters."""
+    if str(plan.get("ID")) not in candidates:
+        raise ValueError(f"tool {plan.get('ID')} is not in the Tool List")
+    tool_guidelines = dataset[str(plan["ID"])]["tool_guidelines"]
+    if not isinstance(plan.get("apis"), list) or len(plan["apis"]) == 0:
+        raise ValueError("no APIs in the plan")
+    for api in plan["apis"]:
+        if api["api_name"] not in tool_guidelines:
+            raise ValueError(f"{api['api_name']} is not an API of tool {plan['ID']}")
+        para_ls = api["Parameters"] if isinstance(api["Parameters"], list) else [api["Parameters"]]
+        for parameters in para_ls:
+            if not isinstance(parameters, dict):
+                raise ValueError(f"parameters of {api['api_name']} are not a JSON object")
+            for required in tool_guidelines[api["api_name"]].get("required_parameters", []):
+                name = required["name"] if isinstance(required, dict) else required
+                if name not in parameters:
+                    raise ValueError(f"{api['api_name']} lacks the required parameter {name}")
+
+
+@traced
 def answer_generation(question, API_instruction, call_result, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -254,24 +310,16 @@ def answer_generation(question, API_instruction, call_result, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question,
-                               call_result=call_result)
-            break
-        except Exception as e:
-            print(f"answer generation fails:{e}")
-            if ind > 2:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  call_result=call_result,
+                                                  attempt=ind)
+        return result
+    return retry_call("answer generation", attempt, max_attempts=4)
 
 
+@traced
 def answer_generation_depend(question, API_instruction, call_result, model_name, previous_log):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -291,25 +339,17 @@ def answer_generation_depend(question, API_instruction, call_result, model_name,
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question,
-                               call_result=call_result,
-                               previous_log=previous_log)
-            break
-        except Exception as e:
-            print(f"answer generation depend fails:{e}")
-            if ind > 2:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question,
+                                                  call_result=call_result,
+                                                  previous_log=previous_log,
+                                                  attempt=ind)
+        return result
+    return retry_call("answer generation depend", attempt, max_attempts=4)
 
 
+@traced
 def answer_check(question, answer, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -323,97 +363,102 @@ def answer_check(question, answer, model_name):
         "Output: "
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(question=question, answer=answer)
+    result = llm_run(chat_prompt, model_name, question=question, answer=answer)
     if 'yes'.lower() in str(result).lower():
         return 1
     else:
         return -1
 
 
+@traced
+@recorded("Call_function", lambda A, B, arg, index, id: (A, B, arg))
+@cached_tool_call
 def Call_function(A, B, arg, index, id):
-    if A in index:
-        for path in index[A]:
-            app_path = os.path.join(path, A, 'api.py')
-            if os.path.isfile(app_path):
-                spec = importlib.util.spec_from_file_location('api', app_path)
-                app_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(app_module)
-                arg['toolbench_rapidapi_key'] = os.environ['RAPIDAPI_KEY']
-                # Check if B is a function in app
-                if hasattr(app_module, B):
-                    function_B = getattr(app_module, B)
-                    try:
-                        call_result = function_B(**arg)
-                        return call_result
-                    except Exception as e:
-                        try:
-                            arg = {change_name(k.lower()): v for k, v in arg.items()}
-                            call_result = function_B(**arg)
-                            return call_result
-                        except Exception as e:
-                            try:
-                                arg = {change_name(k.replace("-", "_")): v for k, v in arg.items()}
-                                call_result = function_B(**arg)
-                                return call_result
-                            except Exception as e:
-                                try:
-                                    arg = {change_name(k.replace("\\", "")): v for k, v in arg.items()}
-                                    call_result = function_B(**arg)
-                                    return call_result
-                                except Exception as e:
-                                    print(f"Call function fails:{e}")
-                                    with open('wrong_log.json', 'a+', encoding='utf-8') as f:
-                                        line = json.dumps({
-                                            "id": id,
-                                            "parameters": arg,
-                                            "wrong": str(e)
-                                        }, ensure_ascii=False)
-                                        f.write(line + '\n')
-                                    return -1
-                else:
-                    with open('wrong_log.json', 'a+', encoding='utf-8') as f:
-                        line = json.dumps({
-                            "id": id,
-                            "parameters": arg,
-                            "wrong": f"No function named {B} in {app_path}"
-                        }, ensure_ascii=False)
-                        f.write(line + '\n')
-                    return (f"No function named {B} in {app_path}")
-
-
-def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, index, previous_log=None):
-    tool_id = choose_tool(question, Tool_dic, tool_used, model_name)
-    if tool_id == -1:
-        return tool_id, "", "", "", ""
-    if str(tool_id["ID"]) not in dataset:
-        return tool_id, "", "", "", ""
-    tool_instruction = dataset[str(tool_id["ID"])]
-    API_instruction = tool_instruction["tool_description"]
-    API_tool = tool_instruction["standardized_name"]
-    API_list = []
-    for ele in tool_instruction["tool_guidelines"].keys():
-        API_list.append(ele)
-
-    api_selection = choose_API(API_instruction, API_list, question, model_name)
-    api_result = []
-    if len(api_selection) == 0:
-        call_result = ""
-        print("No Calling")
-        return tool_id, api_result, call_result, tool_instruction, API_instruction
-    for api in api_selection:
-        if previous_log is None:
-            parameter = choose_parameter(API_instruction, api,
-                                         tool_instruction["tool_guidelines"][api], question,
-                                         model_name)
+    annotate(tool=A, api=B)
+    app_path = resolve_tool_path(index, A)
+    if app_path is not None:
+        arg['toolbench_rapidapi_key'] = os.environ['RAPIDAPI_KEY']
+        # The tool module is loaded, and the arguments bound to function B, where the call runs.
+        try:
+            call_result, unknown = call_tool(app_path, B, arg)
+            error = None
+        except Exception as e:
+            error, unknown = e, getattr(e, "unknown_parameters", [])
+        if unknown:
+            print(f"Call function {B} ignores unknown parameters: {unknown}")
+            annotate(unknown_parameters=unknown)
+        if error is None:
+            return call_result
+        if not isinstance(error, ToolNotFound):
+            print(f"Call function fails: {error}")
+        with open('wrong_log.json', 'a+', encoding='utf-8') as f:
+            line = json.dumps({
+                "id": id,
+                "parameters": arg,
+                "unknown_parameters": unknown,
+                "wrong": str(error)
+            }, ensure_ascii=False)
+            f.write(line + '\n')
+        tool_call_failed(error)
+        annotate(outcome="failed")
+        if isinstance(error, ToolNotFound):
+            return str(error)
+        return -1
+
+
+@traced
+def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, index, previous_log=None,
+              planning='staged', cancelled=None):
+    plan = -1
+    check_cancelled(cancelled)
+    if planning == 'fused':
+        plan = choose_plan(question, Tool_dic, dataset, tool_used, model_name, previous_log)
+    if plan != -1:
+        tool_id = {"ID": plan["ID"]}
+        tool_instruction = dataset[str(plan["ID"])]
+        API_instruction = tool_instruction["tool_description"]
+        API_tool = tool_instruction["standardized_name"]
+        api_result = [{"api_name": api["api_name"], "parameters": api["Parameters"]} for api in plan["apis"]]
+    else:
+        check_cancelled(cancelled)
+        candidates = [key for ele in Tool_dic for key in ele if str(key) not in tool_used]
+        if len(candidates) == 1:
+            # A speculative attempt is given its tool, there is nothing to choose.
+            tool_id = {"ID": candidates[0]}
         else:
-            parameter = choose_parameter_depend(API_instruction, api,
-                                                tool_instruction["tool_guidelines"][api],
-                                                question, previous_log,
-                                                model_name)
-        if parameter == -1:
-            continue
-        api_result.append({"api_name": api, "parameters": parameter})
+            tool_id = choose_tool(question, Tool_dic, tool_used, model_name)
+        if tool_id == -1:
+            return tool_id, "", "", "", ""
+        if str(tool_id["ID"]) not in dataset:
+            return tool_id, "", "", "", ""
+        tool_instruction = dataset[str(tool_id["ID"])]
+        API_instruction = tool_instruction["tool_description"]
+        API_tool = tool_instruction["standardized_name"]
+        API_list = []
+        for ele in tool_instruction["tool_guidelines"].keys():
+            API_list.append(ele)
+
+        check_cancelled(cancelled)
+        api_selection = choose_API(API_instruction, API_list, question, model_name)
+        api_result = []
+        if len(api_selection) == 0:
+            call_result = ""
+            print("No Calling")
+            return tool_id, api_result, call_result, tool_instruction, API_instruction
+        for api in api_selection:
+            check_cancelled(cancelled)
+            if previous_log is None:
+                parameter = choose_parameter(API_instruction, api,
+                                             tool_instruction["tool_guidelines"][api], question,
+                                             model_name)
+            else:
+                parameter = choose_parameter_depend(API_instruction, api,
+                                                    tool_instruction["tool_guidelines"][api],
+                                                    question, previous_log,
+                                                    model_name)
+            if parameter == -1:
+                continue
+            api_result.append({"api_name": api, "parameters": parameter})
     if len(api_result) == 0:
         call_result = ""
         return tool_id, api_result, call_result, tool_instruction, API_instruction
@@ -428,18 +473,24 @@ def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, index, pr
                     value = api["parameters"][key]
                     key = change_name(key)
                     parameters[key] = value
+                check_cancelled(cancelled)
                 call_result = Call_function(API_tool, api_name, parameters, index, ind)
                 if call_result == -1:
                     continue
                 call_results.append(str(call_result))
             elif isinstance(api["parameters"], list):
+                parameters_ls = []
                 for para_ls in api["parameters"]:
                     parameters = {}
                     for key in para_ls:
                         value = para_ls[key]
                         key = change_name(key)
                         parameters[key] = value
-                    call_result = Call_function(API_tool, api_name, parameters, index, ind)
+                    parameters_ls.append(parameters)
+                # The calls with each parameter set are independent, so they run concurrently.
+                check_cancelled(cancelled)
+                for call_result in fan_out(lambda parameters: Call_function(API_tool, api_name, parameters, index, ind),
+                                           parameters_ls):
                     if call_result == -1:
                         continue
                     call_results.append(str(call_result))
@@ -471,8 +522,8 @@ def retrieval(question, Tool_dic, dataset, tool_used, ind, model_name, index, pr
     return tool_id, api_result, call_result, tool_instruction, API_instruction
 
 
+@traced
 def task_decompose(question, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -489,25 +540,16 @@ def task_decompose(question, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question)
-            result = eval(result.split('\n\n')[0])
-            a = result["Tasks"]
-            break
-        except Exception as e:
-            print(f"task decompose fails:{e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return result
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question, attempt=ind)
+        result = parse_structured(result, 'task_decompose', expect=dict)
+        a = result["Tasks"]
+        return result
+    return retry_call("task decompose", attempt)
 
 
+@traced
 def task_topology(question, task_ls, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -525,40 +567,31 @@ def task_topology(question, task_ls, model_name):
         "Output: "
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(question=question, task_ls=task_ls)
-            result = eval(result)
-            for i in range(len(result)):
-                if isinstance(result[i]['dep'], str):
-                    temp = []
-                    for ele in result[i]['dep'].split(','):
-                        temp.append(int(ele))
-                    result[i]['dep'] = temp
-                elif isinstance(result[i]['dep'], int):
-                    result[i]['dep'] = [result[i]['dep']]
-                elif isinstance(result[i]['dep'], list):
-                    temp = []
-                    for ele in result[i]['dep']:
-                        temp.append(int(ele))
-                    result[i]['dep'] = temp
-                elif result[i]['dep'] == -1:
-                    result[i]['dep'] = [-1]
-            a = result[i]['dep'][0]
-            return result
-        except Exception as e:
-            print(f"task topology fails:{e}")
-            if ind > 10:
-                return -1
-            ind += 1
-            continue
-    return result
-
-
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, question=question, task_ls=task_ls, attempt=ind)
+        result = parse_structured(result, 'task_topology', expect=list)
+        for i in range(len(result)):
+            if isinstance(result[i]['dep'], str):
+                temp = []
+                for ele in result[i]['dep'].split(','):
+                    temp.append(int(ele))
+                result[i]['dep'] = temp
+            elif isinstance(result[i]['dep'], int):
+                result[i]['dep'] = [result[i]['dep']]
+            elif isinstance(result[i]['dep'], list):
+                temp = []
+                for ele in result[i]['dep']:
+                    temp.append(int(ele))
+                result[i]['dep'] = temp
+            elif result[i]['dep'] == -1:
+                result[i]['dep'] = [-1]
+        a = result[i]['dep'][0]
+        return result
+    return retry_call("task topology", attempt)
+
+
+@traced
 def answer_summarize(question, answer_task, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -569,13 +602,12 @@ def answer_summarize(question, answer_task, model_name):
         "Final answer:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(question=question, answer_task=answer_task)
+    result = llm_run(chat_prompt, model_name, question=question, answer_task=answer_task)
     return result
 
 
+@traced
 def answer_generation_direct(task, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful assistant."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -584,13 +616,12 @@ def answer_generation_direct(task, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    result = chain.run(task=task)
+    result = llm_run(chat_prompt, model_name, task=task)
     return result
 
 
+@traced
 def tool_check(task, model_name):
-    chat = ChatOpenAI(model_name=model_name)
     template = "You are a helpful language model which can use external APIs to solve user's question."
     system_message_prompt = SystemMessagePromptTemplate.from_template(template)
     human_message_prompt = HumanMessagePromptTemplate.from_template(
@@ -609,128 +640,201 @@ def tool_check(task, model_name):
         "Output:"
     )
     chat_prompt = ChatPromptTemplate.from_messages([system_message_prompt, human_message_prompt])
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
-    ind = 0
-    while True:
-        try:
-            result = chain.run(task=task)
-            result = eval(result)
-            a = result["Reason"]
-            b = result["Choice"]
-            if 'yes' in b.lower():
-                return result, -1
+    def attempt(ind):
+        result = llm_run(chat_prompt, model_name, task=task, attempt=ind)
+        result = parse_structured(result, 'tool_check', expect=dict)
+        a = result["Reason"]
+        b = result["Choice"]
+        if 'yes' in b.lower():
+            return result, -1
+        else:
+            return result, 1
+    return retry_call("tool check", attempt, default=("", -1))
+
+
+@traced
+def subtask_execution(task_dic, task_depend, references, dataset, retrieval_num, ind, model_name, index,
+                      planning='staged', speculate=1, budget=None):
+    task = task_dic['task']
+    answer_ls = []
+    answer_task = []
+    api_result_ls = []
+    call_result_ls = []
+    tool_check_reason, tool_check_result = tool_check(task, model_name)
+    if tool_check_result == 1:
+        print("Do not need tool.")
+        answer = answer_generation_direct(task, model_name)
+        answer_task.append({'task': task, 'answer': answer})
+    else:
+        print("Do need tool.")
+        depend_id = task_dic['dep']
+        tool_used = []
+        Tool_dic = [{tool: dataset[str(tool)]["tool_description"]} for tool in references]
+        previous_log = None
+        if depend_id[0] != -1:
+            previous_log = []
+            for ids in depend_id:
+                previous_log.append(task_depend[ids])
+
+        def attempt(tools, cancelled=None):
+            # Once cancelled is set, another speculative attempt already passed answer_check and
+            # this one stops before its next stage.
+            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task,
+                                                                                            tools,
+                                                                                            dataset,
+                                                                                            tool_used,
+                                                                                            ind,
+                                                                                            model_name,
+                                                                                            index,
+                                                                                            previous_log=previous_log,
+                                                                                            planning=planning,
+                                                                                            cancelled=cancelled)
+            call_result = str(call_result)[:1000]
+            check_cancelled(cancelled)
+            if previous_log is None:
+                answer = answer_generation(task, API_instruction,
+                                           call_result, model_name)
             else:
-                return result, 1
-        except Exception as e:
-            print(f"tool check fails:{e}")
-            if ind > 10:
-                return "", -1
-            ind += 1
-            continue
-    return result, -1
+                answer = answer_generation_depend(task, API_instruction, call_result, model_name,
+                                                  previous_log=previous_log)
+            check_cancelled(cancelled)
+            check_index = answer_check(task, answer, model_name)
+            return {"tool_id": tool_id, "api_result": api_result, "call_result": call_result,
+                    "answer": answer, "check_index": check_index}
+
+        remaining = retrieval_num
+        ranked = None
+        while remaining > 0:
+            candidates = [{key: ele[key]} for ele in Tool_dic for key in ele if str(key) not in tool_used]
+            width = 1
+            if speculate > 1 and len(candidates) > 1:
+                width += budget.take(min(speculate, remaining, len(candidates)) - 1)
+            if width == 1:
+                results = [attempt(Tool_dic)]
+            else:
+                # Each speculative attempt gets one of the best ranked candidate tools to itself. The
+                # tools are ranked once per subtask, later rounds go on with the ones not tried yet.
+                if ranked is None:
+                    ranked = rank_tools(task, candidates, model_name)
+                candidates = [tool for tool in ranked if str(next(iter(tool))) not in tool_used]
+                results = first_accepted([functools.partial(attempt, [tool]) for tool in candidates[:width]],
+                                         lambda result: result["check_index"] == 1)
+            remaining -= width
+            for result in results:
+                answer = result["answer"]
+                if result["check_index"] == 1:
+                    answer_task.append({'task': task, 'answer': answer})
+                    api_result_ls.append(result["api_result"])
+                    call_result_ls.append(result["call_result"])
+                    remaining = 0
+                    break
+                answer_ls.append({'task': task, 'answer': answer})
+                try:
+                    tool_used.append(str(result["tool_id"]["ID"]))
+                except:
+                    continue
+            else:
+                print('****Try Again****')
+    task_depend[task_dic['id']]['answer'] = answer
+    return {
+        "answer_task": answer_task,
+        "answer_wrong": answer_ls,
+        "api_result_ls": api_result_ls,
+        "call_result_ls": call_result_ls,
+        "tool_check_reason": tool_check_reason,
+    }
+
+
+def query_execution(i, data, data_type, base_path, index, dataset, retriever, retrieval_num, model_name,
+                    planning, speculate, speculation_budget):
+    question = data["query"]
+    print(question)
+    temp = task_decompose(question, model_name)['Tasks']
+    task_ls = []
+    for t in range(len(temp)):
+        task_ls.append({"task": temp[t], "id": t + 1})
+    task_ls = task_topology(question, task_ls, model_name)
+    # Every subtask is embedded and searched in one batch, whether it turns out to need a tool or not.
+    tasks = list(dict.fromkeys(task_dic['task'] for task_dic in task_ls))
+    references = dict(zip(tasks, retrieve_references(retriever, tasks, k=5)))
+    budget = SpeculationBudget(speculation_budget)
+    task_depend = {}
+    for task_dic in task_ls:
+        task_depend[task_dic['id']] = {'task': task_dic['task'], 'answer': ''}
+    subtask_results = execute_task_graph(
+        task_ls, lambda task_dic: subtask_execution(task_dic, task_depend, references[task_dic['task']], dataset,
+                                                    retrieval_num, i, model_name, index, planning, speculate,
+                                                    budget))
+    answer_ls = []
+    answer_task = []
+    api_result_ls = []
+    call_result_ls = []
+    tool_check_reason_ls = []
+    parameter_ls = []
+    for subtask_result in subtask_results:
+        answer_ls.extend(subtask_result["answer_wrong"])
+        answer_task.extend(subtask_result["answer_task"])
+        api_result_ls.extend(subtask_result["api_result_ls"])
+        call_result_ls.extend(subtask_result["call_result_ls"])
+        tool_check_reason_ls.append(subtask_result["tool_check_reason"])
+    final_answer = answer_summarize(question, answer_task, model_name)
+    check_index = answer_check(question, final_answer, model_name)
+
+    print(final_answer)
+    return {
+        "ID": i + 1,
+        "question": question,
+        "final_answer": final_answer,
+        "subtask": task_ls,
+        "answer_subtask": answer_task,
+        "answer_wrong": answer_ls,
+        "check_index": check_index,
+        "execute_log": {
+            "api_result_ls": api_result_ls,
+            "parameter_ls": parameter_ls,
+            "call_result_ls": call_result_ls,
+            "tool_check_reason_ls": tool_check_reason_ls,
+        }
+    }
 
 
 def task_execution(data_type,
                    base_path, index, dataset, test_data, progress_file,
-                   start_index, total_files, retrieval_num, ind, model_name):
-    with open("data_toolbench/tool_instruction/API_description_embeddings.pkl", "rb") as file:
-        filenames, embedded_texts = pickle.load(file)
-    with tqdm(total=total_files, desc="Processing files", initial=start_index) as pbar:
-        for i, data in enumerate(test_data[start_index:], start=start_index):
-            answer_ls = []
-            question = data["query"]
-            print(question)
-            temp = task_decompose(question, model_name)['Tasks']
-            task_ls = []
-            for t in range(len(temp)):
-                task_ls.append({"task": temp[t], "id": t + 1})
-            task_ls = task_topology(question, task_ls, model_name)
-            task_depend = {}
-            for task_dic in task_ls:
-                task_depend[task_dic['id']] = {'task': task_dic['task'], 'answer': ''}
-            answer_task = []
-            api_result_ls = []
-            call_result_ls = []
-            tool_check_reason_ls = []
-            parameter_ls = []
-            for task_dic in task_ls:
-                task = task_dic['task']
-                tool_check_reason, tool_check_result = tool_check(task, model_name)
-                tool_check_reason_ls.append(tool_check_reason)
-                if tool_check_result == 1:
-                    print("Do not need tool.")
-                    answer = answer_generation_direct(task)
-                    answer_task.append({'task': task, 'answer': answer})
-                else:
-                    print("Do need tool.")
-                    depend_id = task_dic['dep']
-                    tool_used = []
-                    Tool_dic = [{tool: dataset[str(tool)]["tool_description"]} for tool in
-                                retrieve_reference(embedded_texts, filenames, task, k=5)]
-                    for r in range(retrieval_num):
-                        if depend_id[0] == -1:
-                            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task,
-                                                                                                            Tool_dic,
-                                                                                                            dataset,
-                                                                                                            tool_used,
-                                                                                                            ind,
-                                                                                                            model_name,
-                                                                                                            index)
-                            call_result = str(call_result)[:1000]
-                            answer = answer_generation(task, API_instruction,
-                                                       call_result, model_name)
-                        else:
-                            previous_log = []
-                            for ids in depend_id:
-                                previous_log.append(task_depend[ids])
-                            tool_id, api_result, call_result, tool_instruction, API_instruction = retrieval(task,
-                                                                                                            Tool_dic,
-                                                                                                            dataset,
-                                                                                                            tool_used,
-                                                                                                            ind,
-                                                                                                            model_name,
-                                                                                                            index,
-                                                                                                            previous_log=previous_log)
-                            call_result = str(call_result)[:1000]
-                            answer = answer_generation_depend(task, API_instruction, call_result, model_name,
-                                                              previous_log=previous_log)
-
-                        check_index = answer_check(task, answer, model_name)
-                        if check_index == 1:
-                            answer_task.append({'task': task, 'answer': answer})
-                            api_result_ls.append(api_result)
-                            call_result_ls.append(call_result)
-                            break
-                        else:
-                            answer_ls.append({'task': task, 'answer': answer})
-                            try:
-                                tool_used.append(str(tool_id["ID"]))
-                            except:
-                                continue
-                            print('****Try Again****')
-                task_depend[task_dic['id']]['answer'] = answer
-            final_answer = answer_summarize(question, answer_task, model_name)
-            check_index = answer_check(question, final_answer, model_name)
-
-            ind = ind + 1
-            with open(f'''{data_type}_{model_name}_retrieve_Easytool.jsonl''', 'a+', encoding='utf-8') as f:
-                line = json.dumps({
-                    "ID": ind,
-                    "question": question,
-                    "final_answer": final_answer,
-                    "subtask": task_ls,
-                    "answer_subtask": answer_task,
-                    "answer_wrong": answer_ls,
-                    "check_index": check_index,
-                    "execute_log": {
-                        "api_result_ls": api_result_ls,
-                        "parameter_ls": parameter_ls,
-                        "call_result_ls": call_result_ls,
-                        "tool_check_reason_ls": tool_check_reason_ls,
-                    }
-                }, ensure_ascii=False)
-                f.write(line + '\n')
-
-            print(final_answer)
-            update_progress(progress_file, i + 1)
-            pbar.update(1)
+                   retrieval_num, model_name, workers=1, warmup=False, ann=None, nprobe=8,
+                   retriever_type='embedding', planning='staged', speculate=1,
+                   speculation_budget=4, shard=None):
+    # Start the tool workers, if any, before the first query needs them. Tool modules are then
+    # only loaded in the workers, so there is nothing to warm up in this process.
+    if get_sandbox() is None and warmup:
+        warm_up_tools(test_data, dataset, index)
+    if retriever_type in ('bm25', 'hybrid'):
+        lexical = load_bm25_index(dataset, "data_toolbench/tool_instruction/toolbench_tool_instruction.bm25.pkl")
+    if retriever_type in ('embedding', 'hybrid'):
+        store_path = "data_toolbench/tool_instruction/API_description_embeddings"
+        if has_embedding_store(store_path):
+            dense = load_embedding_store(store_path)
+        else:
+            with open(store_path + ".pkl", "rb") as file:
+                filenames, embedded_texts = pickle.load(file)
+            dense = EmbeddingRetriever(embedded_texts, filenames)
+        if ann == 'ivf':
+            dense = load_ivf_index(dense, store_path, nprobe)
+    if retriever_type == 'bm25':
+        retriever = lexical
+    elif retriever_type == 'hybrid':
+        retriever = HybridRetriever(lexical, dense)
+    else:
+        retriever = dense
+    execute_queries(test_data,
+                    lambda i, data: query_execution(i, data, data_type, base_path, index, dataset,
+                                                    retriever, retrieval_num, model_name, planning, speculate,
+                                                    speculation_budget),
+                    f'''{data_type}_{model_name}_retrieve_Easytool.jsonl''', progress_file, workers, shard)
+    print(f"Tool module cache: {get_tool_modules().stats()}")
+    print(f"Parse failures: {parse_stats()}")
+    if get_tool_result_cache() is not None:
+        print(f"Tool result cache: {get_tool_result_cache().stats()}")
+    if get_sandbox() is not None:
+        print(f"Tool sandbox: {get_sandbox().stats()}")
+    if get_embedding_cache() is not None:
+        print(f"Embedding cache: {get_embedding_cache().stats()}")
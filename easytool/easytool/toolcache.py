@@ -0,0 +1,148 @@
+# — coding: utf-8 –
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from cache import *
+from tracing import *
+from toolenv import *
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+_failure = contextvars.ContextVar("tool_call_failure", default=None)
+# Failures before the tool function was called, which repeat for the same arguments: a missing
+# API or required parameters left unset. Whatever the tool raises itself, even a TypeError while
+# reading a malformed response, may come from a passing outage and is not cached.
+DETERMINISTIC_ERRORS = (ToolNotFound, ToolBindingError)
+
+
+def canonical_arguments(arg):
+    """Arguments as the API sees them: normalized names, sorted, scalars as query-string text."""
+    def value(v):
+        if isinstance(v, dict):
+            return {str(k): value(x) for k, x in v.items()}
+        if isinstance(v, (list, tuple)):
+            return [value(x) for x in v]
+        if v is None or isinstance(v, bool):
+            return v
+        return str(v).strip()
+    return {k.lower().replace("-", "_").replace("\\", ""): value(v) for k, v in sorted(arg.items())
+            if k != 'toolbench_rapidapi_key'}
+
+
+class ToolResultCache:
+    """Persistent results of tool calls, keyed by tool, API and canonical arguments.
+
+    Results expire after the TTL of their tool (ttl unless tool_ttls names the tool; 0 never
+    caches it). Deterministic failures are cached as well, for negative_ttl seconds.
+    """
+
+    def __init__(self, path, ttl=86400, tool_ttls=None, negative_ttl=3600):
+        self.store = SQLiteCache(path)
+        self.ttl = ttl
+        self.tool_ttls = tool_ttls or {}
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+
+    def tool_ttl(self, tool):
+        return self.tool_ttls.get(tool, self.ttl)
+
+    def lookup(self, tool, api, arg):
+        """Return (True, result) for a fresh entry, or (False, None)."""
+        entry = self.store.get(cache_key("tool_result", tool, api, canonical_arguments(arg)))
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            ttl = self.negative_ttl if entry["failed"] else self.tool_ttl(tool)
+            if time.time() - entry["stored"] > ttl:
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            if entry["failed"]:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+        return True, entry["result"]
+
+    def save(self, tool, api, arg, result, failed=False):
+        if (self.negative_ttl if failed else self.tool_ttl(tool)) <= 0:
+            return
+        try:
+            json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError):
+            result = str(result)
+        self.store.set(cache_key("tool_result", tool, api, canonical_arguments(arg)),
+                       {"result": result, "failed": failed, "stored": time.time()})
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses,
+                    "expired": self.expired,
+                    "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0}
+
+
+def get_tool_result_cache():
+    """The tool result cache named by EASYTOOL_TOOL_RESULT_CACHE, or None when unset.
+
+    EASYTOOL_TOOL_RESULT_TTL and EASYTOOL_TOOL_NEGATIVE_TTL give the TTLs in seconds, and
+    EASYTOOL_TOOL_RESULT_TTLS a JSON file mapping tool names to their own TTL.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None and os.environ.get("EASYTOOL_TOOL_RESULT_CACHE"):
+            tool_ttls = None
+            if os.environ.get("EASYTOOL_TOOL_RESULT_TTLS"):
+                with open(os.environ["EASYTOOL_TOOL_RESULT_TTLS"], 'r', encoding='utf-8') as f:
+                    tool_ttls = json.load(f)
+            _result_cache = ToolResultCache(os.environ["EASYTOOL_TOOL_RESULT_CACHE"],
+                                            float(os.environ.get("EASYTOOL_TOOL_RESULT_TTL", 86400)),
+                                            tool_ttls,
+                                            float(os.environ.get("EASYTOOL_TOOL_NEGATIVE_TTL", 3600)))
+    return _result_cache
+
+
+def tool_call_failed(e):
+    """Tell the enclosing cached_tool_call why the call failed."""
+    failure = _failure.get()
+    if failure is not None:
+        failure.append(e)
+
+
+def cached_tool_call(func):
+    """Serve Call_function(A, B, arg, ...) from the tool result cache when one is configured.
+
+    Results are cached unless they are None; a failure is cached only when tool_call_failed
+    reported that the function was never called, so errors raised by the tool are retried.
+    """
+    @functools.wraps(func)
+    def wrapper(A, B, arg, *args, **kwargs):
+        cache = get_tool_result_cache()
+        if cache is None:
+            return func(A, B, arg, *args, **kwargs)
+        found, result = cache.lookup(A, B, arg)
+        if found:
+            annotate(cache="hit")
+            return result
+        annotate(cache="miss")
+        key_arg = dict(arg)
+        failure = []
+        token = _failure.set(failure)
+        try:
+            result = func(A, B, arg, *args, **kwargs)
+        finally:
+            _failure.reset(token)
+        if failure:
+            if isinstance(failure[-1], DETERMINISTIC_ERRORS):
+                cache.save(A, B, key_arg, result, failed=True)
+        elif result is not None:
+            cache.save(A, B, key_arg, result)
+        return result
+    return wrapper
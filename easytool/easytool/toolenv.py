@@ -0,0 +1,304 @@
+# — coding: utf-8 –
+import http.cookiejar
+import importlib.util
+import inspect
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from util import *
+
+
+class ToolModuleCache:
+    """Bounded LRU registry of loaded ToolBench api.py modules.
+
+    Entries are keyed by (path, mtime), so an edited api.py is executed again on its next use
+    instead of being served stale.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._modules = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, app_path):
+        key = (app_path, os.path.getmtime(app_path))
+        with self._lock:
+            if key in self._modules:
+                self._modules.move_to_end(key)
+                self.hits += 1
+                return self._modules[key]
+            self.misses += 1
+        spec = importlib.util.spec_from_file_location('api', app_path)
+        app_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(app_module)
+        inject_transport(app_module)
+        with self._lock:
+            for stale in [k for k in self._modules if k[0] == app_path and k != key]:
+                del self._modules[stale]
+            self._modules[key] = app_module
+            while len(self._modules) > self.maxsize:
+                self._modules.popitem(last=False)
+        return app_module
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "loaded": len(self._modules)}
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+class SessionRequests:
+    """Stands in for the requests module inside tool modules, sending every call through one Session.
+
+    The session keeps connections alive, holds at most pool_size connections per host (callers
+    wait for a free one), applies timeout to calls that set none and keeps no cookies, so tools
+    cannot see each other's. Everything else is looked up on the requests module.
+    """
+
+    def __init__(self, pool_size=32, timeout=(5, 30)):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request("GET", url, params=params, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request("OPTIONS", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request("PUT", url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request("PATCH", url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+def get_transport():
+    """The shared transport of tool modules, configured by EASYTOOL_HTTP_POOL_SIZE,
+    EASYTOOL_HTTP_CONNECT_TIMEOUT and EASYTOOL_HTTP_READ_TIMEOUT."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = SessionRequests(int(os.environ.get("EASYTOOL_HTTP_POOL_SIZE", 32)),
+                                         (float(os.environ.get("EASYTOOL_HTTP_CONNECT_TIMEOUT", 5)),
+                                          float(os.environ.get("EASYTOOL_HTTP_READ_TIMEOUT", 30))))
+    return _transport
+
+
+def set_transport(transport):
+    """Use transport, any object with the requests functions, in tool modules loaded from now on."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+def inject_transport(app_module):
+    # Tool modules call requests.get and friends on the module they imported.
+    if getattr(app_module, "requests", None) is requests:
+        app_module.requests = get_transport()
+
+
+def _scan_dir(path, cached, dirs):
+    # A directory whose mtime is unchanged still has the same entries, so only changed
+    # directories are listed again; their subdirectories are still checked one by one.
+    mtime = os.stat(path).st_mtime
+    entry = cached.get(path)
+    if entry is None or entry["mtime"] != mtime:
+        subdirs = []
+        has_api = False
+        with os.scandir(path) as entries:
+            for item in entries:
+                if item.is_dir(follow_symlinks=False):
+                    subdirs.append(item.name)
+                elif item.name == 'api.py':
+                    has_api = True
+        entry = {"mtime": mtime, "subdirs": sorted(subdirs), "api": has_api}
+    dirs[path] = entry
+    for name in entry["subdirs"]:
+        _scan_dir(os.path.join(path, name), cached, dirs)
+
+
+def load_tool_index(base_path, index_file):
+    """Map every tool directory name under base_path to its api.py path.
+
+    Directory mtimes are saved in index_file, so a later start-up only lists the directories
+    that changed since instead of walking the whole tree.
+    """
+    cached = {}
+    if os.path.exists(index_file):
+        with open(index_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get("base_path") == base_path:
+            cached = saved["dirs"]
+    dirs = {}
+    _scan_dir(base_path, cached, dirs)
+    if dirs != cached:
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump({"base_path": base_path, "dirs": dirs}, f, ensure_ascii=False)
+    index = {}
+    for path, entry in dirs.items():
+        if entry["api"]:
+            index.setdefault(os.path.basename(path), os.path.join(path, 'api.py'))
+    return index
+
+
+def resolve_tool_path(index, tool_name):
+    """api.py of tool_name, or None.
+
+    index maps names to api.py paths as load_tool_index does; the lists of parent directories
+    built by util.build_index are still accepted and probed in order.
+    """
+    entry = index.get(tool_name)
+    if isinstance(entry, str):
+        return entry
+    for path in entry or []:
+        app_path = os.path.join(path, tool_name, 'api.py')
+        if os.path.isfile(app_path):
+            return app_path
+    return None
+
+
+_tool_modules = None
+_tool_modules_lock = threading.Lock()
+
+
+def get_tool_modules():
+    """The loaded tool modules, at most EASYTOOL_TOOL_CACHE_SIZE of them, created on first use."""
+    global _tool_modules
+    with _tool_modules_lock:
+        if _tool_modules is None:
+            _tool_modules = ToolModuleCache(int(os.environ.get("EASYTOOL_TOOL_CACHE_SIZE", 512)))
+    return _tool_modules
+
+
+def load_tool_module(app_path):
+    return get_tool_modules().load(app_path)
+
+
+_signatures = weakref.WeakKeyDictionary()
+_signatures_lock = threading.Lock()
+
+
+def tool_signature(function):
+    """(parameter names, required names, takes **kwargs) of a tool function, inspected once."""
+    with _signatures_lock:
+        if function in _signatures:
+            return _signatures[function]
+    parameters = inspect.signature(function).parameters.values()
+    names = [p.name for p in parameters if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+    required = [p.name for p in parameters
+                if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY) and p.default is p.empty]
+    var_keyword = any(p.kind == p.VAR_KEYWORD for p in parameters)
+    with _signatures_lock:
+        _signatures[function] = (names, required, var_keyword)
+    return names, required, var_keyword
+
+
+def _parameter_form(name):
+    return name.lower().replace("-", "_").replace("\\", "")
+
+
+def bind_arguments(function, arg):
+    """Map the argument names an LLM produced onto the parameters of a tool function.
+
+    A name is used as given when the function has it, and otherwise matched on its lowercased
+    form with - as _ and without backslashes, also after change_name. Returns (kwargs, unknown,
+    missing): the arguments to call with, the names that match no parameter and are left out,
+    and the required parameters that are still unset.
+    """
+    names, required, var_keyword = tool_signature(function)
+    forms = {}
+    for name in names:
+        forms.setdefault(_parameter_form(name), name)
+    kwargs = {}
+    unknown = []
+    for key, value in arg.items():
+        if key in names:
+            name = key
+        else:
+            name = forms.get(_parameter_form(key)) or forms.get(_parameter_form(change_name(_parameter_form(key))))
+        if name is not None:
+            kwargs.setdefault(name, value)
+        elif var_keyword:
+            kwargs[key] = value
+        elif key != 'toolbench_rapidapi_key':
+            unknown.append(key)
+    missing = [name for name in required if name not in kwargs]
+    return kwargs, unknown, missing
+
+
+class ToolNotFound(AttributeError):
+    pass
+
+
+class ToolBindingError(TypeError):
+    pass
+
+
+def run_tool(app_path, name, arg):
+    """Load the tool module, bind arg to its function name and call it once.
+
+    Returns (result, unknown parameter names). An exception raised on the way carries the unknown
+    names as unknown_parameters; ToolNotFound and ToolBindingError mean the function was never
+    called.
+    """
+    function = getattr(load_tool_module(app_path), name, None)
+    if function is None:
+        raise ToolNotFound(f"No function named {name} in {app_path}")
+    kwargs, unknown, missing = bind_arguments(function, arg)
+    try:
+        if missing:
+            raise ToolBindingError(f"{name}() is missing required parameters: {missing}")
+        return function(**kwargs), unknown
+    except Exception as e:
+        e.unknown_parameters = unknown
+        raise
+
+
+def warm_up_tools(test_data, dataset, index):
+    """Preload the api.py of every tool listed in the Tool_dic of the test split."""
+    tool_names = []
+    for data in test_data:
+        for ele in data.get("Tool_dic", []):
+            ids = [ele["ID"]] if "ID" in ele else list(ele.keys())
+            for tool_id in ids:
+                if str(tool_id) in dataset:
+                    tool_name = dataset[str(tool_id)]["standardized_name"]
+                    if tool_name not in tool_names:
+                        tool_names.append(tool_name)
+    for tool_name in tool_names[:get_tool_modules().maxsize]:
+        app_path = resolve_tool_path(index, tool_name)
+        if app_path is not None:
+            try:
+                load_tool_module(app_path)
+            except Exception as e:
+                print(f"warm up {tool_name} fails: {e}")
+    print(f"Warmed up {get_tool_modules().stats()['loaded']} tool modules")
@@ -0,0 +1,112 @@
+# — coding: utf-8 –
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("easytool_span", default=None)
+_events = None
+_events_lock = threading.Lock()
+_TOKEN_KEYS = ("prompt_tokens", "completion_tokens")
+# Tokens of responses served from a cache or archive, which cost nothing this run.
+_CACHED_TOKENS = "cached_tokens"
+
+
+class Span:
+    """One timed stage of a query; all spans of a query share the list of their root."""
+
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.spans = parent.spans if parent is not None else []
+        self.spans.append(self)
+        self.thread = threading.get_ident()
+        self.start = time.time()
+        self.duration = None
+
+    def export(self):
+        """The spans under this root as JSON-serializable dicts, with tokens summed into the root."""
+        for key in _TOKEN_KEYS + (_CACHED_TOKENS,):
+            self.attrs[key] = sum(s.attrs.get(key, 0) for s in self.spans if s is not self)
+        threads = {}
+        return [{"name": s.name,
+                 "parent": self.spans.index(s.parent) if s.parent is not None else None,
+                 "thread": threads.setdefault(s.thread, len(threads)),
+                 "start": round(s.start - self.start, 6),
+                 "duration": round(s.duration, 6) if s.duration is not None else None,
+                 **s.attrs} for s in self.spans]
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a child of the current span; its outcome is error if it raises."""
+    current = Span(name, _current.get(), attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.attrs.setdefault("outcome", "error")
+        raise
+    finally:
+        current.duration = time.time() - current.start
+        current.attrs.setdefault("outcome", "ok")
+        _current.reset(token)
+        if _events is not None:
+            with _events_lock:
+                _events.append({"name": current.name, "ph": "X", "pid": os.getpid(), "tid": current.thread,
+                                "ts": current.start * 1e6, "dur": current.duration * 1e6,
+                                "args": dict(current.attrs)})
+
+
+def traced(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def annotate(**attrs):
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def count_retry():
+    current = _current.get()
+    if current is not None:
+        current.attrs["retries"] = current.attrs.get("retries", 0) + 1
+
+
+def add_tokens(usage, cached=False):
+    current = _current.get()
+    if current is not None and usage:
+        if cached:
+            tokens = sum(usage.get(key, 0) for key in _TOKEN_KEYS)
+            current.attrs[_CACHED_TOKENS] = current.attrs.get(_CACHED_TOKENS, 0) + tokens
+            return
+        for key in _TOKEN_KEYS:
+            current.attrs[key] = current.attrs.get(key, 0) + usage.get(key, 0)
+
+
+def run_in_context(executor, fn, *args):
+    """executor.submit that carries the current span over into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def start_recording():
+    global _events
+    with _events_lock:
+        _events = []
+
+
+def write_chrome_trace(path):
+    """Write every span recorded since start_recording as Chrome trace events, for Perfetto."""
+    with _events_lock:
+        events = list(_events or [])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
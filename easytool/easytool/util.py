@@ -89,20 +89,14 @@ def standardize(string):
     return string
 
 
-def get_last_processed_index(progress_file):
-    """Retrieve the last processed index from the progress file."""
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            last_index = f.read().strip()
-            return int(last_index) if last_index else 0
-    else:
-        return 0
-
-
-def update_progress(progress_file, index):
-    """Update the last processed index in the progress file."""
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        f.write(str(index))
+def update_progress(progress_file, indices):
+    """Update the set of processed test_data indices in the progress file."""
+    tmp_file = progress_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(sorted(indices)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, progress_file)
 
 
 if __name__ == '__main__':
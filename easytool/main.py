@@ -6,6 +6,7 @@ import os
 from tqdm import tqdm
 from easytool import funcQA, restbench, toolbench_retrieve, toolbench
 from easytool.util import *
+from easytool.scheduler import parse_shard
 openai.api_key = os.environ["OPENAI_API_KEY"]
         
 if __name__ == '__main__':
@@ -15,8 +16,68 @@ if __name__ == '__main__':
     parser.add_argument('--data_type', type=str, default='G3', help='G2 or G3 or funcqa_mh or funcqa_oh')
     parser.add_argument('--tool_root_dir', type=str, default='.toolenv/tools/')
     parser.add_argument('--retrieval_num', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help='number of queries executed concurrently')
+    parser.add_argument('--max_inflight', type=int, default=64, help='maximum number of concurrent LLM requests')
+    parser.add_argument('--rpm', type=float, default=0, help='LLM requests per minute across all workers, 0 for no limit')
+    parser.add_argument('--tpm', type=float, default=0, help='LLM tokens per minute across all workers, 0 for no limit')
+    parser.add_argument('--llm_cache', type=str, default='', help='SQLite file caching LLM responses')
+    parser.add_argument('--llm_cache_mode', type=str, default='readwrite', choices=['readwrite', 'replay'], help='readwrite or replay')
+    parser.add_argument('--llm_cache_max_mb', type=float, default=0, help='evict old LLM responses above this size')
+    parser.add_argument('--warmup_tools', action='store_true', help='preload the api.py of the tools in the test split')
+    parser.add_argument('--trace_file', type=str, default='', help='write a Chrome trace of every stage and tool call here')
+    parser.add_argument('--shard', type=str, default='', help='run only shard i/N of the test data, e.g. 0/4')
+    parser.add_argument('--tool_index', type=str, default='tool_index.json', help='saved tool directory index')
+    parser.add_argument('--tool_cache_size', type=int, default=512, help='number of loaded tool modules kept in memory')
+    parser.add_argument('--retriever', type=str, default='embedding', choices=['bm25', 'embedding', 'hybrid'], help='bm25, embedding or hybrid')
+    parser.add_argument('--planning', type=str, default='staged', choices=['staged', 'fused'], help='staged, or fused to choose tool, APIs and parameters in one call')
+    parser.add_argument('--speculate', type=int, default=1, help='candidate tools tried concurrently per subtask, 1 to try them one by one')
+    parser.add_argument('--speculation_budget', type=int, default=4, help='extra speculative attempts allowed per query')
+    parser.add_argument('--ann', type=str, default='', choices=['', 'ivf'], help='approximate tool retrieval index: ivf, or empty for exact search')
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scanned per query, higher is slower but more accurate')
+    parser.add_argument('--embedding_cache', type=str, default='embedding_cache.db', help='SQLite file caching text embeddings, empty to disable')
+    parser.add_argument('--tool_result_cache', type=str, default='', help='SQLite file caching tool call results, empty to disable')
+    parser.add_argument('--tool_result_ttl', type=float, default=86400, help='seconds a cached tool call result stays valid')
+    parser.add_argument('--tool_result_ttls', type=str, default='', help='JSON file mapping tool names to their own TTL, 0 for never cached')
+    parser.add_argument('--tool_negative_ttl', type=float, default=3600, help='seconds a deterministic tool call failure stays cached')
+    parser.add_argument('--sandbox_workers', type=int, default=0, help='run tool calls in this many worker processes, 0 to run them in-process')
+    parser.add_argument('--tool_timeout', type=float, default=30, help='seconds a sandboxed tool call may take')
+    parser.add_argument('--query_tool_timeout', type=float, default=0, help='seconds all tool calls of a query may take together, 0 for no limit')
+    parser.add_argument('--sandbox_max_rss_mb', type=float, default=1024, help='replace a tool worker once its memory grows past this')
+    parser.add_argument('--http_pool_size', type=int, default=32, help='connections kept open per host for tool calls')
+    parser.add_argument('--http_connect_timeout', type=float, default=5, help='seconds to connect for a tool HTTP request')
+    parser.add_argument('--http_read_timeout', type=float, default=30, help='seconds to wait for a tool HTTP response')
+    parser.add_argument('--record', type=str, default='', help='record LLM responses, embeddings and tool call results into this archive')
+    parser.add_argument('--replay', type=str, default='', help='replay a run from a --record archive without any network access')
     
     args = parser.parse_args()
+    os.environ["EASYTOOL_MAX_INFLIGHT"] = str(args.max_inflight)
+    os.environ["EASYTOOL_RPM"] = str(args.rpm)
+    os.environ["EASYTOOL_TPM"] = str(args.tpm)
+    if args.trace_file:
+        os.environ["EASYTOOL_TRACE_FILE"] = args.trace_file
+    os.environ["EASYTOOL_TOOL_CACHE_SIZE"] = str(args.tool_cache_size)
+    os.environ["EASYTOOL_EMBEDDING_CACHE"] = args.embedding_cache
+    if args.tool_result_cache:
+        os.environ["EASYTOOL_TOOL_RESULT_CACHE"] = args.tool_result_cache
+        os.environ["EASYTOOL_TOOL_RESULT_TTL"] = str(args.tool_result_ttl)
+        os.environ["EASYTOOL_TOOL_NEGATIVE_TTL"] = str(args.tool_negative_ttl)
+        if args.tool_result_ttls:
+            os.environ["EASYTOOL_TOOL_RESULT_TTLS"] = args.tool_result_ttls
+    os.environ["EASYTOOL_SANDBOX_WORKERS"] = str(args.sandbox_workers)
+    os.environ["EASYTOOL_TOOL_TIMEOUT"] = str(args.tool_timeout)
+    os.environ["EASYTOOL_QUERY_TOOL_TIMEOUT"] = str(args.query_tool_timeout)
+    os.environ["EASYTOOL_SANDBOX_MAX_RSS_MB"] = str(args.sandbox_max_rss_mb)
+    os.environ["EASYTOOL_HTTP_POOL_SIZE"] = str(args.http_pool_size)
+    os.environ["EASYTOOL_HTTP_CONNECT_TIMEOUT"] = str(args.http_connect_timeout)
+    os.environ["EASYTOOL_HTTP_READ_TIMEOUT"] = str(args.http_read_timeout)
+    if args.record or args.replay:
+        os.environ["EASYTOOL_ARCHIVE"] = args.record or args.replay
+        os.environ["EASYTOOL_ARCHIVE_MODE"] = 'record' if args.record else 'replay'
+    if args.llm_cache:
+        os.environ["EASYTOOL_LLM_CACHE"] = args.llm_cache
+        os.environ["EASYTOOL_LLM_CACHE_MODE"] = args.llm_cache_mode
+        if args.llm_cache_max_mb:
+            os.environ["EASYTOOL_LLM_CACHE_MAX_MB"] = str(args.llm_cache_max_mb)
     
     if args.task == 'funcqa':
         dataset = read_json('data_funcqa/tool_instruction/functions_data.json')
@@ -27,7 +88,8 @@ if __name__ == '__main__':
         
     elif 'toolbench' in args.task:
         base_path = args.tool_root_dir
-        index = build_index(base_path)
+        # Replayed tool calls never load a tool, so the tool tree does not have to exist.
+        index = {} if args.replay else toolbench.load_tool_index(base_path, args.tool_index)
         dataset = read_json('data_toolbench/tool_instruction/toolbench_tool_instruction.json')
         if args.data_type == 'G2':
             test_data = read_json(f'''data_toolbench/test_data/{args.data_type}_category.json''')
@@ -48,41 +110,40 @@ if __name__ == '__main__':
         print("Wrong task name")
         exit()  
         
-    start_index = get_last_processed_index(progress_file)
-    total_files = len(test_data)
     retrieval_num = args.retrieval_num
-    ind = start_index
     model_name = args.model_name
+    workers = args.workers
+    shard = parse_shard(args.shard) if args.shard else None
     
     print("-------Start Execution-------")
     if args.data_type == 'funcqa_mh':
-        funcQA.task_execution_mh(args.data_type, start_index, total_files, 
-                                        retrieval_num, ind, model_name, dataset, 
-                                        Tool_dic, test_data, progress_file)
+        funcQA.task_execution_mh(args.data_type, retrieval_num, model_name, dataset,
+                                 Tool_dic, test_data, progress_file, workers, shard)
     elif args.data_type == 'funcqa_oh':
-        funcQA.task_execution_oh(args.data_type, start_index, total_files, 
-                                        retrieval_num, ind, model_name, dataset, 
-                                        Tool_dic, test_data, progress_file)
+        funcQA.task_execution_oh(args.data_type, retrieval_num, model_name, dataset,
+                                 Tool_dic, test_data, progress_file, workers, shard)
         
         
     elif args.task == 'toolbench_retrieve':
         toolbench_retrieve.task_execution(args.data_type,
             base_path, index, dataset, test_data, progress_file, 
-            start_index, total_files, retrieval_num, ind, model_name)
+            retrieval_num, model_name, workers, args.warmup_tools, args.ann, args.nprobe,
+            args.retriever, args.planning, args.speculate, args.speculation_budget, shard)
 
         
     
     elif args.task == 'toolbench':
         toolbench.task_execution(args.data_type,
             base_path, index, dataset, test_data, progress_file, 
-            start_index, total_files, retrieval_num, ind, model_name)
+            retrieval_num, model_name, workers, args.warmup_tools, args.planning,
+            args.speculate, args.speculation_budget, shard)
 
         
     
     elif args.task == 'restbench':
         restbench.task_execution(
             Tool_dic, dic_tool, test_data, progress_file, 
-            start_index, total_files, retrieval_num, ind, model_name)
+            retrieval_num, model_name, workers, shard)
 
     
     else:
@@ -0,0 +1,69 @@
+# — coding: utf-8 –
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+
+
+def find_shards(result_file):
+    """Map shard index to path for every {root}.shard{i}of{N}{ext} next to result_file."""
+    root, ext = os.path.splitext(result_file)
+    shards = {}
+    counts = set()
+    for path in glob.glob(f"{glob.escape(root)}.shard*of*{ext}"):
+        match = re.fullmatch(re.escape(root) + r"\.shard(\d+)of(\d+)" + re.escape(ext), path)
+        if match:
+            shards[int(match.group(1))] = path
+            counts.add(int(match.group(2)))
+    if len(counts) > 1:
+        raise ValueError(f"Shard files of {result_file} come from runs with different shard counts: {sorted(counts)}")
+    return shards, counts.pop() if counts else 0
+
+
+def merge_shards(result_file, total=None):
+    """Merge the shard outputs of result_file by ID; returns the records and a list of problems."""
+    shards, count = find_shards(result_file)
+    problems = []
+    if not count:
+        return [], [f"No shard files found for {result_file}"]
+    for missing in sorted(set(range(count)) - set(shards)):
+        problems.append(f"Shard {missing}/{count} has no output file")
+    records = {}
+    for shard in sorted(shards):
+        with open(shards[shard], 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["ID"] in records:
+                    problems.append(f"Duplicate ID {record['ID']} in {shards[shard]}")
+                    continue
+                records[record["ID"]] = record
+    expected = range(1, (total or max(records, default=0)) + 1)
+    missing = [ID for ID in expected if ID not in records]
+    for shard in sorted({(ID - 1) % count for ID in missing}):
+        ids = [ID for ID in missing if (ID - 1) % count == shard]
+        problems.append(f"Shard {shard}/{count} is missing {len(ids)} IDs: {ids[:20]}")
+    return [records[ID] for ID in sorted(records)], problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the outputs of a main.py --shard i/N run")
+    parser.add_argument('result_file', type=str, help='unsharded output name, e.g. G2_gpt-3.5-turbo_Easytool.jsonl')
+    parser.add_argument('--total', type=int, default=0, help='number of test queries, to detect missing trailing IDs')
+    parser.add_argument('--output', type=str, default='', help='defaults to result_file')
+    parser.add_argument('--force', action='store_true', help='write the merged file even if IDs are missing')
+    args = parser.parse_args()
+
+    records, problems = merge_shards(args.result_file, args.total)
+    for problem in problems:
+        print(problem)
+    if problems and not args.force:
+        print("Nothing written; re-run the shards above or pass --force")
+        sys.exit(1)
+    with open(args.output or args.result_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"Merged {len(records)} records into {args.output or args.result_file}")